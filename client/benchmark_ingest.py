@@ -0,0 +1,333 @@
+import multiprocessing
+import http.server
+import contextlib
+import tempfile
+import argparse
+import platform
+import resource
+import datetime
+import hashlib
+import shutil
+import time
+import io
+import json
+import yaml
+import sys
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pyzipper
+import pygame
+
+from client import ArchiveManager, PerformanceMetrics
+from benchmark_viewer import make_page, summarize
+
+
+# Ingest benchmark against a local stand-in for the archive server
+#
+#   python benchmark_ingest.py --archives 4 --parallel 1 3 --chunk-sizes 65536 262144
+
+
+archive_key = 'benchmark'
+source_name = 'bench'
+
+
+class ArchiveRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    www_folder = ''
+
+
+    def log_message(self, *args):
+
+        pass
+
+
+    def do_GET(self):
+
+        file_name = 'index.json' if self.path == '/' else self.path.lstrip('/')
+        file_path = os.path.join(self.www_folder, file_name)
+
+        if not os.path.isfile(file_path):
+
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        file_size = os.path.getsize(file_path)
+        range_start = 0
+
+        range_header = self.headers.get('Range')
+        if range_header:
+
+            range_start = int(range_header.split('=')[1].split('-')[0])
+
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {range_start}-{file_size - 1}/{file_size}')
+
+        else:
+            self.send_response(200)
+
+        self.send_header('Content-Length', str(file_size - range_start))
+        self.end_headers()
+
+        with open(file_path, 'rb') as served_file:
+
+            served_file.seek(range_start)
+            shutil.copyfileobj(served_file, self.wfile)
+
+
+def serve(www_folder, port_queue):
+
+    ArchiveRequestHandler.www_folder = www_folder
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ArchiveRequestHandler)
+    port_queue.put(server.server_address[1])
+
+    server.serve_forever()
+
+
+def make_archives(www_folder, archive_count, page_count, low_res_size, high_res_factor, compression):
+
+    pygame.init()
+
+    pages_folder = os.path.join(www_folder, 'pages')
+    os.mkdir(pages_folder)
+
+    high_res_size = (round(low_res_size[0] * high_res_factor), round(low_res_size[1] * high_res_factor))
+
+    page_paths = []
+    for page_nr in range(1, page_count + 1):
+
+        low_res_path = os.path.join(pages_folder, f'{page_nr:02d}_lo.png')
+        high_res_path = os.path.join(pages_folder, f'{page_nr:02d}_hi.png')
+
+        make_page(low_res_path, low_res_size, page_nr)
+        make_page(high_res_path, high_res_size, page_nr)
+
+        page_paths += [low_res_path, high_res_path]
+
+    archive_names = []
+    today = datetime.date.today()
+
+    for archive_nr in range(archive_count):
+
+        archive_date = today - datetime.timedelta(days=archive_nr)
+        archive_name_base = f'{source_name}_{archive_date.strftime("%d-%m-%Y")}'
+
+        # Same password scheme as the server, md5 of the key and the archive name
+        archive_pw = hashlib.md5((archive_key + archive_name_base).encode()).hexdigest().encode()
+        archive_info = {'page_count': page_count, 'dpi_low': 100, 'dpi_high': round(100 * high_res_factor)}
+
+        archive_path = os.path.join(www_folder, f'{archive_name_base}.zip')
+
+        with pyzipper.AESZipFile(archive_path, 'w', compression=compression, encryption=pyzipper.WZ_AES) as archive_file:
+
+            archive_file.setpassword(archive_pw)
+            archive_file.writestr('info.json', json.dumps(archive_info))
+
+            for page_path in page_paths:
+                archive_file.write(page_path, os.path.basename(page_path))
+
+        archive_names.append(f'{archive_name_base}.zip')
+
+    shutil.rmtree(pages_folder)
+
+    with open(os.path.join(www_folder, 'index.json'), 'w') as index_file:
+        json.dump({'archives': archive_names}, index_file)
+
+    return archive_names
+
+
+def peak_rss_mb():
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS bytes
+    return peak_rss / 1024 if sys.platform != 'darwin' else peak_rss / (1024 * 1024)
+
+
+def prepare_run(run_folder, server_host):
+
+    os.mkdir(run_folder)
+    os.chdir(run_folder)
+
+    with open(ArchiveManager.credentials_path, 'w') as credentials_file:
+        yaml.safe_dump({'archive_host': server_host, 'archive_key': archive_key}, credentials_file)
+
+    PerformanceMetrics.histograms.clear()
+    PerformanceMetrics.counters.clear()
+
+
+def metric_summary(name):
+
+    histogram = PerformanceMetrics.histograms.get(name)
+    return histogram.summary() if histogram else None
+
+
+def bench_sequential(run_folder, server_host, archive_names):
+
+    prepare_run(run_folder, server_host)
+    archive_man = ArchiveManager()
+
+    index_time = time.perf_counter()
+    archive_man.update_available()
+    index_time = time.perf_counter() - index_time
+
+    archive_name = archive_names[0]
+    archive_size = os.path.getsize(os.path.join(ArchiveRequestHandler.www_folder, archive_name))
+
+    start_time = time.perf_counter()
+    for percentage in archive_man.download_archive(archive_name):
+        pass
+
+    ingest_time = time.perf_counter() - start_time
+    archive_man.database_store.flush()
+
+    return {
+        'update_available_ms': 1000 * index_time,
+        'download_archive_ms': 1000 * ingest_time,
+        'end_to_end_mbps': archive_size / ingest_time / 1e6}
+
+
+def bench_recent(run_folder, server_host, archive_names, parallel_downloads, chunk_size):
+
+    prepare_run(run_folder, server_host)
+
+    ArchiveManager.parallel_downloads = parallel_downloads
+    ArchiveManager.download_chunk_size = chunk_size
+    ArchiveManager.history_days = len(archive_names)
+
+    archive_man = ArchiveManager()
+
+    index_time = time.perf_counter()
+    archive_man.update_available()
+    index_time = time.perf_counter() - index_time
+
+    total_size = sum(os.path.getsize(os.path.join(ArchiveRequestHandler.www_folder, name)) for name in archive_names)
+
+    start_time = time.perf_counter()
+    for percentage in archive_man.download_recent():
+        pass
+
+    ingest_time = time.perf_counter() - start_time
+    new_entries = archive_man.pop_new_entries()
+
+    # Decrypting is what every page read costs now that archives are kept
+    decrypt_times, decode_times = [], []
+    decrypt_size = decode_size = 0
+
+    for entry in new_entries:
+        for page_key, page_members in archive_man.get_entry_pages(entry):
+            for page_member in page_members:
+
+                decrypt_start = time.perf_counter()
+                member_data = archive_man.page_store.read_member(entry, page_member.name)
+                decrypt_times.append(time.perf_counter() - decrypt_start)
+
+                decode_start = time.perf_counter()
+                pygame.image.load(io.BytesIO(member_data), page_member.name)
+                decode_times.append(time.perf_counter() - decode_start)
+
+                decrypt_size += len(member_data)
+                decode_size += len(member_data)
+
+    archive_man.database_store.flush()
+
+    return {
+        'parallel_downloads': parallel_downloads,
+        'chunk_size': chunk_size,
+        'archives_ingested': len(new_entries),
+        'update_available_ms': 1000 * index_time,
+        'download_recent_ms': 1000 * ingest_time,
+        'end_to_end_mbps': total_size / ingest_time / 1e6,
+        'download_mbps': metric_summary('download_mbps'),
+        'store_ms': metric_summary('store_ms'),
+        'decrypt_mbps': decrypt_size / sum(decrypt_times) / 1e6 if decrypt_times else None,
+        'decrypt_member': summarize(decrypt_times),
+        'decode_mbps': decode_size / sum(decode_times) / 1e6 if decode_times else None,
+        'peak_rss_mb': peak_rss_mb()}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Ingest benchmark against a local archive server')
+
+    parser.add_argument('--archives', type=int, default=4)
+    parser.add_argument('--pages', type=int, default=8)
+    parser.add_argument('--low-res', type=int, nargs=2, default=(1000, 1480), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--high-res-factor', type=float, default=3.0)
+    parser.add_argument('--deflate', action='store_true')
+    parser.add_argument('--parallel', type=int, nargs='+', default=(1, 3))
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=(64 * 1024, 256 * 1024, 1024 * 1024))
+    parser.add_argument('--output', default='-')
+
+    args = parser.parse_args()
+
+    compression = pyzipper.ZIP_DEFLATED if args.deflate else pyzipper.ZIP_STORED
+    working_folder = os.getcwd()
+
+    # Client logging goes to stderr so the JSON on stdout stays parseable
+    with contextlib.redirect_stdout(sys.stderr):
+
+        with tempfile.TemporaryDirectory() as bench_folder:
+
+            www_folder = os.path.join(bench_folder, 'www')
+            os.mkdir(www_folder)
+
+            generate_time = time.perf_counter()
+            archive_names = make_archives(www_folder, args.archives, args.pages, args.low_res, args.high_res_factor, compression)
+            generate_time = time.perf_counter() - generate_time
+
+            ArchiveRequestHandler.www_folder = www_folder
+
+            # A spawned server does not inherit the initialised pygame state of this process
+            server_context = multiprocessing.get_context('spawn')
+
+            port_queue = server_context.Queue()
+            server_process = server_context.Process(target=serve, args=(www_folder, port_queue), daemon=True)
+            server_process.start()
+
+            server_host = f'http://127.0.0.1:{port_queue.get()}/'
+            archive_size = os.path.getsize(os.path.join(www_folder, archive_names[0]))
+
+            results = {
+                'environment': {
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'archives': args.archives,
+                    'pages': args.pages,
+                    'high_res_factor': args.high_res_factor,
+                    'archive_size_mb': archive_size / 1e6,
+                    'compression': 'deflate' if args.deflate else 'stored',
+                    'generate_sec': generate_time},
+                'download_archive': bench_sequential(os.path.join(bench_folder, 'sequential'), server_host, archive_names),
+                'download_recent': []}
+
+            for parallel_downloads in args.parallel:
+                for chunk_size in args.chunk_sizes:
+
+                    run_folder = os.path.join(bench_folder, f'recent_{parallel_downloads}_{chunk_size}')
+                    run_result = bench_recent(run_folder, server_host, archive_names, parallel_downloads, chunk_size)
+
+                    results['download_recent'].append(run_result)
+
+            os.chdir(working_folder)
+            server_process.terminate()
+            server_process.join()
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+    else:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+import contextlib
+import tempfile
+import argparse
+import platform
+import random
+import time
+import math
+import json
+import sys
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame
+import pygame.freetype
+
+from client import ImageViewer, RescaleWorker, PagePyramid
+
+
+# Headless benchmark of the viewer render path, results are written as JSON
+#
+#   SDL_VIDEODRIVER=dummy python benchmark_viewer.py --output viewer.json
+
+
+def summarize(samples):
+
+    samples = sorted(samples)
+    count = len(samples)
+
+    if not count:
+        return {'count': 0}
+
+    def percentile(fraction):
+
+        return samples[min(count - 1, math.floor(fraction * count))]
+
+    return {
+        'count': count,
+        'mean_ms': 1000 * sum(samples) / count,
+        'p50_ms': 1000 * percentile(0.5),
+        'p95_ms': 1000 * percentile(0.95),
+        'max_ms': 1000 * samples[-1]}
+
+
+def timed(function, *args):
+
+    start_time = time.perf_counter()
+    result = function(*args)
+
+    return time.perf_counter() - start_time, result
+
+
+def make_page(path, size, seed):
+
+    rng = random.Random(seed)
+    width, height = size
+
+    page = pygame.Surface(size)
+    page.fill((250, 248, 240))
+
+    column_count = 5
+    column_width = width // column_count
+    line_height = max(2, height // 400)
+
+    # Columns of text-like strokes with the odd picture block
+    for column in range(column_count):
+
+        left = column * column_width + column_width // 20
+        top = height // 12
+
+        while top < height - line_height:
+
+            if rng.random() < 0.01:
+
+                block_height = rng.randint(height // 20, height // 6)
+                block_color = [rng.randint(40, 220) for channel in range(3)]
+
+                pygame.draw.rect(page, block_color, (left, top, column_width * 9 // 10, block_height))
+                top += block_height + line_height
+                continue
+
+            stroke_left = left
+            while stroke_left < left + column_width * 9 // 10:
+
+                stroke_width = rng.randint(line_height, 6 * line_height)
+                pygame.draw.rect(page, (30, 30, 30), (stroke_left, top, stroke_width, line_height))
+                stroke_left += stroke_width + line_height
+
+            top += 2 * line_height
+
+    pygame.draw.rect(page, (10, 10, 10), (width // 20, height // 40, width * 9 // 10, height // 25))
+    pygame.image.save(page, path)
+
+
+def make_assets(folder, low_res_size, high_res_factor):
+
+    pygame.init()
+
+    def make_image(name, size, color):
+
+        path = os.path.join(folder, name)
+
+        image = pygame.Surface(size, pygame.SRCALPHA)
+        image.fill(color)
+
+        pygame.image.save(image, path)
+        return path
+
+    ImageViewer.font_file_path = pygame.freetype.get_default_font()
+    if not os.path.isfile(ImageViewer.font_file_path):
+        ImageViewer.font_file_path = os.path.join(os.path.dirname(pygame.__file__), ImageViewer.font_file_path)
+
+    wallpaper = pygame.Surface(ImageViewer.window_size)
+    wallpaper.fill((60, 60, 60))
+
+    ImageViewer.wallpaper_path = os.path.join(folder, 'wallpaper.png')
+    pygame.image.save(wallpaper, ImageViewer.wallpaper_path)
+
+    for icon in ('downloading', 'loading', 'empty'):
+
+        setattr(ImageViewer, f'icon_{icon}_path', make_image(f'{icon}.png', (200, 200), (200, 120, 40, 255)))
+        setattr(ImageViewer, f'icon_{icon}_vig_path', make_image(f'{icon}_vignette.png', (240, 240), (255, 255, 255, 160)))
+
+    ImageViewer.insert_vignette_path = make_image('insert_vignette.png', (ImageViewer.window_size[0], 100), (255, 255, 255, 200))
+    ImageViewer.info_vignette_path = make_image('info_vignette.png', (ImageViewer.window_size[0], 60), (255, 255, 255, 200))
+
+    high_res_size = (round(low_res_size[0] * high_res_factor), round(low_res_size[1] * high_res_factor))
+
+    low_res_path = os.path.join(folder, 'page_lo.png')
+    high_res_path = os.path.join(folder, 'page_hi.png')
+
+    make_page(low_res_path, low_res_size, 1)
+    make_page(high_res_path, high_res_size, 1)
+
+    return low_res_path, high_res_path
+
+
+def settle(viewer, timeout_sec=60.0):
+
+    # Draw until the rescaled tiles for the current view are in place
+    start_time = time.perf_counter()
+
+    while time.perf_counter() - start_time < timeout_sec:
+
+        viewer.draw()
+        if viewer.rescale_mode == 0 and viewer.tiles_complete():
+            return time.perf_counter() - start_time
+
+        time.sleep(0.001)
+
+    return None
+
+
+def draw_frames(viewer, frames, before_frame=None):
+
+    frame_times = []
+
+    for frame in range(frames):
+
+        if before_frame:
+            before_frame(frame)
+
+        frame_time, dt = timed(viewer.draw)
+        frame_times.append(frame_time)
+
+    return frame_times
+
+
+def bench_set_images(viewer, low_res_path, high_res_path, dpi_ratio, repeats):
+
+    decode_low, decode_high, set_images = [], [], []
+
+    for repeat in range(repeats):
+
+        low_time, low_res_image = timed(pygame.image.load, low_res_path)
+        high_time, high_res_image = timed(pygame.image.load, high_res_path)
+
+        set_time, result = timed(viewer.set_images, low_res_image, high_res_image, dpi_ratio)
+
+        decode_low.append(low_time)
+        decode_high.append(high_time)
+        set_images.append(set_time)
+
+    return {
+        'decode_low_res': summarize(decode_low),
+        'decode_high_res': summarize(decode_high),
+        'set_images': summarize(set_images)}
+
+
+def bench_rescale(viewer, scales, repeats):
+
+    results = {}
+
+    for scale in scales:
+
+        viewer.set_scale(scale)
+        viewer.initial_view()
+
+        rescale_times = []
+
+        for repeat in range(repeats):
+
+            # Start from an empty pyramid so level building is part of the measurement
+            viewer.page_pyramid = PagePyramid(viewer.high_res_image)
+
+            start_time = time.perf_counter()
+
+            rescale_worker = RescaleWorker(viewer)
+            rescale_worker.finished.wait()
+
+            rescale_times.append(time.perf_counter() - start_time)
+
+        results[str(scale)] = summarize(rescale_times)
+
+    viewer.set_scale(1.0)
+    return results
+
+
+def bench_steady(viewer, frames):
+
+    viewer.set_scale(1.0)
+    settle(viewer)
+
+    idle = draw_frames(viewer, frames)
+    full = draw_frames(viewer, frames, lambda frame: viewer.invalidate())
+
+    return {'idle': summarize(idle), 'full_redraw': summarize(full)}
+
+
+def bench_low_res(viewer, frames, scale):
+
+    rescale_wait_sec = viewer.rescale_wait_sec
+    viewer.rescale_wait_sec = float('inf')
+
+    viewer.set_scale(scale)
+    viewer.rescaled_sets.clear()
+    viewer.rescaled_sets_size = 0
+
+    low_res = draw_frames(viewer, frames, lambda frame: viewer.invalidate())
+
+    viewer.rescale_wait_sec = rescale_wait_sec
+    viewer.set_scale(1.0)
+
+    return summarize(low_res)
+
+
+def bench_overlays(viewer, frames, frame_interval_sec=1 / 60):
+
+    viewer.set_scale(1.0)
+    settle(viewer)
+
+    # Frames are paced so the fade advances on every one of them
+    fade_time = 1000 * frames * frame_interval_sec
+
+    viewer.display_info(('Benchmark vom 01.01.2000', 'Seite 1'), fade_time)
+    viewer.display_insert(ImageViewer.BOOKMARK, fade_time)
+
+    fading = draw_frames(viewer, frames, lambda frame: time.sleep(frame_interval_sec))
+
+    viewer.clear_info()
+    viewer.clear_insert()
+    viewer.draw()
+
+    return summarize(fading)
+
+
+def bench_pan_zoom(viewer, frames):
+
+    viewer.set_scale(1.0)
+    settle(viewer)
+
+    def script(frame):
+
+        # Zoom in, pan around the page, then zoom back out
+        phase = frame * 4 // frames
+
+        if phase == 0:
+            viewer.change_scale(1.02)
+        elif phase == 1:
+            viewer.move_center(6.0, 4.0)
+        elif phase == 2:
+            viewer.move_center(-4.0, 6.0)
+        else:
+            viewer.change_scale(1 / 1.02)
+
+    pan_zoom = draw_frames(viewer, frames, script)
+    settle_time = settle(viewer)
+
+    return {'frames': summarize(pan_zoom), 'settle_ms': 1000 * settle_time if settle_time is not None else None}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Headless benchmark of the viewer render path')
+
+    parser.add_argument('--low-res', type=int, nargs=2, default=(1000, 1480), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--high-res-factor', type=float, default=3.0)
+    parser.add_argument('--frames', type=int, default=120)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--scales', type=float, nargs='+', default=(1.0, 1.5, 2.0, 3.0, 5.0))
+    parser.add_argument('--output', default='-')
+
+    args = parser.parse_args()
+
+    # Client logging goes to stderr so the JSON on stdout stays parseable
+    with contextlib.redirect_stdout(sys.stderr):
+
+        with tempfile.TemporaryDirectory() as assets_folder:
+
+            low_res_path, high_res_path = make_assets(assets_folder, args.low_res, args.high_res_factor)
+
+            # The client uses dpi_low / dpi_high, the high res page is downscaled by it
+            dpi_ratio = 1 / args.high_res_factor
+
+            # Measure the render path itself, without the frame rate governor waiting between frames
+            ImageViewer.active_fps = ImageViewer.idle_fps = math.inf
+
+            viewer = ImageViewer()
+
+            results = {
+                'environment': {
+                    'python': platform.python_version(),
+                    'pygame': pygame.version.ver,
+                    'sdl': '.'.join(str(part) for part in pygame.get_sdl_version()),
+                    'machine': platform.machine(),
+                    'video_driver': pygame.display.get_driver(),
+                    'window_size': list(viewer.screen.get_size()),
+                    'low_res_size': list(args.low_res),
+                    'high_res_factor': args.high_res_factor,
+                    'dpi_ratio': dpi_ratio},
+                'set_images': bench_set_images(viewer, low_res_path, high_res_path, dpi_ratio, args.repeats)}
+
+            results['rescale_worker'] = bench_rescale(viewer, args.scales, args.repeats)
+            results['draw_steady'] = bench_steady(viewer, args.frames)
+            results['draw_low_res'] = bench_low_res(viewer, args.frames, 2.0)
+            results['draw_overlays'] = bench_overlays(viewer, args.frames)
+            results['draw_pan_zoom'] = bench_pan_zoom(viewer, args.frames)
+
+        RescaleWorker.abort()
+        pygame.quit()
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+    else:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,649 +1,3024 @@
+import concurrent.futures
+import collections
 import threading
+import atexit
+import copy
+import io
 import requests
+import queue
 import pyzipper
 import datetime
 import hashlib
+import shutil
+import bisect
+import struct
+import mmap
 import pygame
 import time
 import math
 import json
 import yaml
 import os
+import sys
 
 
 # ~~~ TODO ~~~
 # - Shutdown routine
-# - Only draw on input
+
+
+class Histogram:
+
+    bucket_first = 0.1
+    bucket_growth = 2.0 ** 0.25
+    bucket_count = 96
+
+
+    def __init__(self):
+
+        self.counts = [0] * (self.bucket_count + 1)
+
+        self.samples = 0
+        self.total = 0.0
+        self.peak = 0.0
+
+
+    def add(self, value):
+
+        if value <= self.bucket_first:
+            bucket = 0
+        else:
+            bucket = min(self.bucket_count, 1 + math.floor(math.log(value / self.bucket_first, self.bucket_growth)))
+
+        self.counts[bucket] += 1
+
+        self.samples += 1
+        self.total += value
+        self.peak = max(self.peak, value)
+
+
+    def bucket_bound(self, bucket):
+
+        if bucket == self.bucket_count:
+            return self.peak
+
+        return min(self.peak, self.bucket_first * self.bucket_growth ** bucket)
+
+
+    def percentile(self, fraction):
+
+        if not self.samples:
+            return 0.0
+
+        rank = fraction * self.samples
+        seen = 0
+
+        for bucket, count in enumerate(self.counts):
+
+            seen += count
+            if seen >= rank:
+                return self.bucket_bound(bucket)
+
+        return self.peak
+
+
+    def summary(self):
+
+        return {
+            'count': self.samples,
+            'mean': self.total / self.samples if self.samples else 0.0,
+            'p50': self.percentile(0.5),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'max': self.peak,
+            'buckets': self.counts}
+
+
+
+class PerformanceMetrics:
+
+    dump_path = 'metrics.json'
+    dump_interval_sec = 60
+
+    histograms = {}
+    counters = {}
+
+    mutex = threading.Lock()
+    start_time = time.time()
+
+
+    def record(name, value):
+
+        PerformanceMetrics.mutex.acquire()
+
+        histogram = PerformanceMetrics.histograms.get(name)
+        if histogram is None:
+            histogram = PerformanceMetrics.histograms[name] = Histogram()
+
+        histogram.add(value)
+        PerformanceMetrics.mutex.release()
+
+
+    def count(name, amount=1):
+
+        PerformanceMetrics.mutex.acquire()
+        PerformanceMetrics.counters[name] = PerformanceMetrics.counters.get(name, 0) + amount
+        PerformanceMetrics.mutex.release()
+
+
+    def percentile(name, fraction):
+
+        PerformanceMetrics.mutex.acquire()
+
+        histogram = PerformanceMetrics.histograms.get(name)
+        value = histogram.percentile(fraction) if histogram else 0.0
+
+        PerformanceMetrics.mutex.release()
+
+        return value
+
+
+    def snapshot():
+
+        PerformanceMetrics.mutex.acquire()
+
+        snapshot = {
+            'host': os.uname().nodename,
+            'platform': sys.platform,
+            'time': time.time(),
+            'uptime_sec': time.time() - PerformanceMetrics.start_time,
+            'histograms': {name: histogram.summary() for name, histogram in PerformanceMetrics.histograms.items()},
+            'counters': dict(PerformanceMetrics.counters)}
+
+        PerformanceMetrics.mutex.release()
+
+        return snapshot
+
+
+    def dump():
+
+        dump_tmp_path = PerformanceMetrics.dump_path + '.tmp'
+
+        with open(dump_tmp_path, 'w') as dump_file:
+            json.dump(PerformanceMetrics.snapshot(), dump_file, indent=1)
+
+        os.replace(dump_tmp_path, PerformanceMetrics.dump_path)
+
+
+    def start():
+
+        dump_th = threading.Thread(target=PerformanceMetrics.dumper, daemon=True)
+        dump_th.start()
+
+        atexit.register(PerformanceMetrics.dump)
+
+
+    def dumper():
+
+        while True:
+            time.sleep(PerformanceMetrics.dump_interval_sec)
+
+            try:
+                PerformanceMetrics.dump()
+            except OSError as error:
+                print(f'Writing metrics failed: {error}')
+
+
+
+class PagePyramid:
+
+    tile_size = 256
+
+    band_height = 256
+    band_overlap = 4
+
+    # smoothscale releases the GIL, so bands and tiles scale on all cores
+    scale_pool = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+    def __init__(self, image):
+
+        self.levels = [image]
+        self.mutex = threading.Lock()
+
+
+    def get_level(self, level):
+
+        self.mutex.acquire()
+
+        while len(self.levels) <= level:
+
+            prev_level = self.levels[-1]
+            prev_width, prev_height = prev_level.get_size()
+
+            level_size = (max(1, prev_width // 2), max(1, prev_height // 2))
+            self.levels.append(self.smoothscale_banded(prev_level, level_size))
+
+        level_image = self.levels[level]
+        self.mutex.release()
+
+        return level_image
+
+
+    def scale_band(self, source, size, band_top, band_bottom):
+
+        source_width, source_height = source.get_size()
+        factor_y = size[1] / source_height
+
+        # The band is scaled with a few rows of its neighbours so the filter sees across the seam
+        padded_top = max(0, band_top - self.band_overlap)
+        padded_bottom = min(source_height, band_bottom + self.band_overlap)
+
+        padded_dest_top = round(padded_top * factor_y)
+        padded_dest_bottom = round(padded_bottom * factor_y)
+
+        dest_top = round(band_top * factor_y)
+        dest_bottom = round(band_bottom * factor_y)
+
+        padded_source = source.subsurface((0, padded_top, source_width, padded_bottom - padded_top))
+        padded_surf = pygame.transform.smoothscale(padded_source, (size[0], padded_dest_bottom - padded_dest_top))
+
+        return padded_surf, (0, dest_top - padded_dest_top, size[0], dest_bottom - dest_top), dest_top
+
+
+    def smoothscale_banded(self, source, size):
+
+        source_height = source.get_height()
+        scaled = pygame.Surface(size, source.get_flags() & pygame.SRCALPHA, source)
+
+        band_futures = []
+        for band_top in range(0, source_height, self.band_height):
+
+            band_bottom = min(source_height, band_top + self.band_height)
+            band_futures.append(self.scale_pool.submit(self.scale_band, source, size, band_top, band_bottom))
+
+        for band_future in band_futures:
+
+            band_surf, band_area, dest_top = band_future.result()
+            scaled.blit(band_surf, (0, dest_top), area=band_area)
+
+        return scaled
+
+
+    def scale_tile(self, level_image, tx, ty, factor):
+
+        tile_source = self.tile_source(level_image, tx, ty)
+        tile_dest = self.tile_dest(level_image, tx, ty, factor)
+
+        if tile_dest.width == 0 or tile_dest.height == 0:
+            return None
+
+        # Same overlap as the bands, tiles are cut from a slightly larger scaled area
+        padded_source = tile_source.inflate(2 * self.band_overlap, 2 * self.band_overlap).clip(level_image.get_rect())
+
+        padded_left = round(padded_source.left * factor)
+        padded_top = round(padded_source.top * factor)
+
+        padded_right = round(padded_source.right * factor)
+        padded_bottom = round(padded_source.bottom * factor)
+
+        padded_surf = pygame.transform.smoothscale(level_image.subsurface(padded_source), (padded_right - padded_left, padded_bottom - padded_top))
+        tile_surf = padded_surf.subsurface(tile_dest.move(-padded_left, -padded_top)).copy()
+
+        return tile_surf, tile_dest
+
+
+    def select_level(self, factor):
+
+        level = 0
+        while factor * 2.0 <= 1.0:
+
+            factor *= 2.0
+            level += 1
+
+        return level, factor
+
+
+    def tile_range(self, level_image, factor, left, top, right, bottom):
+
+        level_width, level_height = level_image.get_size()
+        tile_extent = self.tile_size * factor
+
+        first_x = max(0, math.floor(left / tile_extent))
+        first_y = max(0, math.floor(top / tile_extent))
+
+        last_x = min(math.ceil(level_width / self.tile_size), math.ceil(right / tile_extent))
+        last_y = min(math.ceil(level_height / self.tile_size), math.ceil(bottom / tile_extent))
+
+        tiles = []
+        for ty in range(first_y, last_y):
+            for tx in range(first_x, last_x):
+                tiles.append((tx, ty))
+
+        return tiles
+
+
+    def tile_source(self, level_image, tx, ty):
+
+        level_width, level_height = level_image.get_size()
+
+        left = tx * self.tile_size
+        top = ty * self.tile_size
+
+        width = min(self.tile_size, level_width - left)
+        height = min(self.tile_size, level_height - top)
+
+        return pygame.Rect(left, top, width, height)
+
+
+    def tile_dest(self, level_image, tx, ty, factor):
+
+        source = self.tile_source(level_image, tx, ty)
+
+        left = round(source.left * factor)
+        top = round(source.top * factor)
+
+        right = round(source.right * factor)
+        bottom = round(source.bottom * factor)
+
+        return pygame.Rect(left, top, right - left, bottom - top)
+
 
 
 class RescaleWorker:
 
-    instances = []
+    # One long-lived thread serves all rescales, a newer request replaces a waiting one
+    pending = None
+    current = None
+
+    mutex = threading.Lock()
+    wake_event = threading.Event()
+    th = None
+
+    def __init__(self, viewer):
+
+        self.done = viewer.rescale_done
+
+        self.pyramid = viewer.page_pyramid
+        self.scale = viewer.scale
+
+        self.factor = viewer.scale * viewer.dpi_ratio
+        self.visible = viewer.visible_area(viewer.rescale_margin)
+
+        self.reuse_level = viewer.rescaled_level
+        self.reuse_tiles = viewer.rescaled_tiles
+
+        self.allowed = True
+        self.finished = threading.Event()
+
+        RescaleWorker.submit(self)
+
+
+    def submit(request):
+
+        RescaleWorker.mutex.acquire()
+
+        if RescaleWorker.pending:
+            RescaleWorker.pending.drop()
+
+        if RescaleWorker.current:
+            RescaleWorker.current.allowed = False
+
+        RescaleWorker.pending = request
+
+        if RescaleWorker.th is None:
+            RescaleWorker.th = threading.Thread(target=RescaleWorker.runner, daemon=True)
+            RescaleWorker.th.start()
+
+        RescaleWorker.mutex.release()
+        RescaleWorker.wake_event.set()
+
+
+    def runner():
+
+        while True:
+
+            RescaleWorker.wake_event.wait()
+            RescaleWorker.wake_event.clear()
+
+            RescaleWorker.mutex.acquire()
+
+            request = RescaleWorker.pending
+            RescaleWorker.pending = None
+            RescaleWorker.current = request
+
+            RescaleWorker.mutex.release()
+
+            if request is None:
+                continue
+
+            request.worker()
+
+            RescaleWorker.mutex.acquire()
+            RescaleWorker.current = None
+            RescaleWorker.mutex.release()
+
+
+    def worker(self):
+
+        start_time = time.perf_counter()
+
+        level, level_factor = self.pyramid.select_level(self.factor)
+        level_image = self.pyramid.get_level(level)
+
+        # Tiles still valid from the last rescale at this scale are kept, the rest dropped
+        reuse_tiles = {}
+        if self.reuse_level and self.reuse_level[0] is level_image and self.reuse_level[2] == self.scale:
+            reuse_tiles = self.reuse_tiles
+
+        tile_bands = collections.OrderedDict()
+        for tx, ty in self.pyramid.tile_range(level_image, level_factor, *self.visible):
+            tile_bands.setdefault(ty, []).append((tx, ty))
+
+        band_futures = []
+        for band_tiles in tile_bands.values():
+            band_futures.append(self.pyramid.scale_pool.submit(self.scale_band, level_image, level_factor, band_tiles, reuse_tiles))
+
+        rescaled_tiles = {}
+        for band_future in band_futures:
+            rescaled_tiles.update(band_future.result())
+
+        RescaleWorker.mutex.acquire()
+
+        rescale_done = self.allowed
+        if rescale_done:
+            self.done(level_image, level_factor, self.scale, rescaled_tiles)
+
+        RescaleWorker.mutex.release()
+
+        if rescale_done:
+            PerformanceMetrics.record('rescale_ms', 1000 * (time.perf_counter() - start_time))
+        else:
+            PerformanceMetrics.count('rescale_cancelled')
+
+        self.finished.set()
+
+
+    def scale_band(self, level_image, level_factor, band_tiles, reuse_tiles):
+
+        band_rescaled = {}
+
+        # Cancelling takes effect at the next band
+        if not self.allowed:
+            return band_rescaled
+
+        for tile in band_tiles:
+
+            if tile in reuse_tiles:
+                band_rescaled[tile] = reuse_tiles[tile]
+                continue
+
+            rescaled_tile = self.pyramid.scale_tile(level_image, *tile, level_factor)
+            if rescaled_tile:
+                band_rescaled[tile] = rescaled_tile
+
+        return band_rescaled
+
+
+    def drop(self):
+
+        self.allowed = False
+        self.finished.set()
+
+        PerformanceMetrics.count('rescale_cancelled')
+
+
+    def abort():
+
+        RescaleWorker.mutex.acquire()
+
+        if RescaleWorker.pending:
+            RescaleWorker.pending.drop()
+            RescaleWorker.pending = None
+
+        if RescaleWorker.current:
+            RescaleWorker.current.allowed = False
+
+        RescaleWorker.mutex.release()
+
+
+
+class PageLoad:
+
+    def __init__(self, key):
+
+        self.key = key
+
+        self.low_res = concurrent.futures.Future()
+        self.high_res = concurrent.futures.Future()
+
+        self.cancelled = False
+
+
+    def cancel(self):
+
+        self.cancelled = True
+
+        self.low_res.cancel()
+        self.high_res.cancel()
+
+
+
+class RawSurfaceCache:
+
+    surfaces_folder = 'surfaces'
+    disk_budget = 2 * 1024 * 1024 * 1024
+
+    header_format = '<4sII4s'
+    header_magic = b'ZLR1'
+
+
+    def __init__(self, decode):
+
+        self.decode = decode
+
+        self.files = collections.OrderedDict()
+        self.disk_used = 0
+
+        self.mutex = threading.Lock()
+        self.write_queue = queue.Queue()
+
+        if not os.path.isdir(self.surfaces_folder):
+            os.mkdir(self.surfaces_folder)
+
+        surface_files = []
+        for dir_entry in os.scandir(self.surfaces_folder):
+
+            if dir_entry.name.endswith('.tmp'):
+                os.remove(dir_entry.path)
+                continue
+
+            dir_entry_stat = dir_entry.stat()
+            surface_files.append((dir_entry_stat.st_mtime, dir_entry.name, dir_entry_stat.st_size))
+
+        for mtime, name, size in sorted(surface_files):
+
+            self.files[name] = size
+            self.disk_used += size
+
+        self.th = threading.Thread(target=self.writer, daemon=True)
+        self.th.start()
+
+
+    def file_name(self, key):
+
+        entry, page_nr, quality = key
+        return f'{entry}_{str(page_nr).zfill(2)}_{quality}.raw'
+
+
+    def contains(self, key):
+
+        return self.file_name(key) in self.files
+
+
+    def load(self, key):
+
+        file_name = self.file_name(key)
+
+        self.mutex.acquire()
+
+        if file_name in self.files:
+            self.files.move_to_end(file_name)
+        else:
+            file_name = None
+
+        self.mutex.release()
+
+        if file_name is None:
+            return None
+
+        # A damaged file is dropped so the page is decoded from its PNG again
+        try:
+            with open(os.path.join(self.surfaces_folder, file_name), 'rb') as surface_file:
+                surface_map = mmap.mmap(surface_file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+            header_size = struct.calcsize(self.header_format)
+            magic, width, height, pixel_format = struct.unpack_from(self.header_format, surface_map)
+
+            pixel_format = pixel_format.decode().strip()
+            pixel_size = {'RGB': 3, 'RGBA': 4}.get(pixel_format)
+
+            if magic != self.header_magic or pixel_size is None:
+                raise ValueError('unknown header')
+
+            if len(surface_map) != header_size + width * height * pixel_size:
+                raise ValueError('size does not match header')
+
+            # The surface keeps the mapping alive, pixels are paged in on first use
+            return pygame.image.frombuffer(memoryview(surface_map)[header_size:], (width, height), pixel_format)
+
+        except (OSError, ValueError, struct.error, pygame.error) as error:
+            print(f'Raw surface {file_name} not readable: {error}')
+
+        self.discard(file_name)
+        return None
+
+
+    def discard(self, file_name):
+
+        self.mutex.acquire()
+
+        if file_name in self.files:
+            self.disk_used -= self.files.pop(file_name)
+
+        self.mutex.release()
+
+        try:
+            os.remove(os.path.join(self.surfaces_folder, file_name))
+        except OSError:
+            pass
+
+
+    def save(self, key, surf):
+
+        self.write_queue.put((key, surf, None))
+
+
+    def fill(self, key, source):
+
+        self.write_queue.put((key, None, source))
+
+
+    def writer(self):
+
+        while True:
+
+            key, surf, source = self.write_queue.get()
+            if self.contains(key):
+                continue
+
+            try:
+                if surf is None:
+                    surf = self.decode(source)
+
+                self.write(key, surf)
+
+            except (pygame.error, pyzipper.BadZipFile, OSError, KeyError, RuntimeError, ValueError, struct.error) as error:
+                print(f'Caching raw surface {key} failed: {error}')
+
+
+    def write(self, key, surf):
+
+        file_name = self.file_name(key)
+        file_path = os.path.join(self.surfaces_folder, file_name)
+
+        pixel_format = 'RGBA' if surf.get_flags() & pygame.SRCALPHA else 'RGB'
+        pixel_data = pygame.image.tobytes(surf, pixel_format)
+
+        header = struct.pack(self.header_format, self.header_magic, surf.get_width(), surf.get_height(), pixel_format.ljust(4).encode())
+
+        with open(file_path + '.tmp', 'wb') as surface_file:
+            surface_file.write(header)
+            surface_file.write(pixel_data)
+
+            surface_file.flush()
+            os.fsync(surface_file.fileno())
+
+        os.replace(file_path + '.tmp', file_path)
+
+        self.mutex.acquire()
+
+        self.files[file_name] = len(header) + len(pixel_data)
+        self.disk_used += self.files[file_name]
+
+        evicted_files = []
+        while self.disk_used > self.disk_budget and len(self.files) > 1:
+
+            evicted_name, evicted_size = self.files.popitem(last=False)
+            self.disk_used -= evicted_size
+
+            evicted_files.append(evicted_name)
+
+        self.mutex.release()
+
+        for evicted_name in evicted_files:
+            os.remove(os.path.join(self.surfaces_folder, evicted_name))
+
+
+
+class PageCache:
+
+    memory_budget = 256 * 1024 * 1024
+    raw_fill_pages = 2
+
+
+    def __init__(self):
+
+        self.pages = collections.OrderedDict()
+        self.memory_used = 0
+
+        self.loading = {}
+        self.mutex = threading.Lock()
+
+        self.prefetch_queue = []
+        self.prefetch_event = threading.Event()
+
+        self.loader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.raw_cache = RawSurfaceCache(self.decode)
+
+        self.th = threading.Thread(target=self.prefetcher, daemon=True)
+        self.th.start()
+
+
+    def surface_size(self, surf):
+
+        return surf.get_pitch() * surf.get_height()
+
+
+    def contains(self, key):
+
+        return key in self.pages
+
+
+    def load(self, key, paths, low_res_ready=None, cancelled=None):
+
+        self.mutex.acquire()
+
+        if key in self.pages:
+            self.pages.move_to_end(key)
+            images = self.pages[key]
+
+            self.mutex.release()
+
+            if low_res_ready:
+                low_res_ready(images[0])
+
+            return images
+
+        loading_event = self.loading.get(key)
+        if loading_event is None:
+            self.loading[key] = threading.Event()
+
+        self.mutex.release()
+
+        if loading_event is not None:
+            loading_event.wait()
+            return self.load(key, paths, low_res_ready, cancelled)
+
+        images = None
+
+        try:
+            low_res_source, high_res_source = paths
+            low_res_image = self.read_surface(key, 'lo', low_res_source)
+
+            if low_res_ready:
+                low_res_ready(low_res_image)
+
+            if cancelled and cancelled():
+                return None
+
+            images = (low_res_image, self.read_surface(key, 'hi', high_res_source))
+            self.insert(key, images)
+
+        finally:
+            self.mutex.acquire()
+            self.loading.pop(key).set()
+            self.mutex.release()
+
+        return images
+
+
+    def read_surface(self, key, quality, source):
+
+        raw_key = (*key, quality)
+        start_time = time.perf_counter()
+
+        surf = self.raw_cache.load(raw_key)
+        if surf is not None:
+            PerformanceMetrics.record('page_raw_ms', 1000 * (time.perf_counter() - start_time))
+
+        else:
+            surf = self.decode(source)
+            PerformanceMetrics.record('page_decode_ms', 1000 * (time.perf_counter() - start_time))
+
+            self.raw_cache.save(raw_key, surf)
+
+        return surf
+
+
+    def fill_raw(self, requests):
+
+        # New editions open on their first pages, the rest is cached as it is read
+        for key, (low_res_source, high_res_source) in requests[:self.raw_fill_pages]:
+
+            self.raw_cache.fill((*key, 'lo'), low_res_source)
+            self.raw_cache.fill((*key, 'hi'), high_res_source)
+
+
+    def decode(self, source):
+
+        if isinstance(source, ArchiveMember):
+            return pygame.image.load(source.open(), source.name)
+
+        return pygame.image.load(source)
+
+
+    def load_async(self, key, paths):
+
+        page_load = PageLoad(key)
+
+        if key in self.pages:
+            self.load_worker(page_load, paths)
+        else:
+            self.loader.submit(self.load_worker, page_load, paths)
+
+        return page_load
+
+
+    def load_worker(self, page_load, paths):
+
+        if page_load.cancelled:
+            return
+
+        def low_res_ready(low_res_image):
+            if page_load.low_res.set_running_or_notify_cancel():
+                page_load.low_res.set_result(low_res_image)
+
+        def cancelled():
+            return page_load.cancelled
+
+        try:
+            images = self.load(page_load.key, paths, low_res_ready, cancelled)
+
+        except (pygame.error, pyzipper.BadZipFile, OSError, KeyError, RuntimeError, ValueError, struct.error) as error:
+            print(f'Loading page {page_load.key} failed: {error}')
+
+            for page_future in (page_load.low_res, page_load.high_res):
+                if not page_future.done() and page_future.set_running_or_notify_cancel():
+                    page_future.set_exception(error)
+            return
+
+        if images and page_load.high_res.set_running_or_notify_cancel():
+            page_load.high_res.set_result(images[1])
+
+
+    def insert(self, key, images):
+
+        images_size = sum(self.surface_size(image) for image in images)
+
+        self.mutex.acquire()
+
+        if key in self.pages:
+            self.memory_used -= sum(self.surface_size(image) for image in self.pages[key])
+
+        self.pages[key] = images
+        self.pages.move_to_end(key)
+        self.memory_used += images_size
+
+        while self.memory_used > self.memory_budget and len(self.pages) > 1:
+
+            evicted_key, evicted_images = self.pages.popitem(last=False)
+            self.memory_used -= sum(self.surface_size(image) for image in evicted_images)
+
+        self.mutex.release()
+
+
+    def prefetch(self, requests):
+
+        self.mutex.acquire()
+        self.prefetch_queue = list(requests)
+        self.mutex.release()
+
+        self.prefetch_event.set()
+
+
+    def prefetcher(self):
+
+        while True:
+
+            self.prefetch_event.wait()
+
+            self.mutex.acquire()
+
+            if self.prefetch_queue:
+                key, paths = self.prefetch_queue.pop(0)
+            else:
+                key, paths = None, None
+                self.prefetch_event.clear()
+
+            self.mutex.release()
+
+            if key is None or key in self.pages:
+                continue
+
+            try:
+                self.load(key, paths)
+                print(f'Prefetched page {key}')
+
+            except (pygame.error, pyzipper.BadZipFile, OSError, KeyError, RuntimeError, ValueError, struct.error) as error:
+                print(f'Prefetching page {key} failed: {error}')
+
+
+
+class ImageViewer:
+
+    run_in_window = True
+    window_size = (800, 1280)
+
+    min_scale = 1.0
+    max_scale = 10.0
+
+    rescale_wait_sec = 0.5
+    rescale_margin = 192
+
+    active_fps = 60
+    idle_fps = 4
+    idle_after_sec = 1.0
+
+    rescale_cache_budget = 96 * 1024 * 1024
+    rescale_cache_steps = 4
+    rescale_cache_ratio_max = 2.0
+    overlay_fade_exp = 0.01
+
+    font_file_path = 'data/Ubuntu-B.ttf'
+    font_notify_size = 30
+    font_hud_size = 16
+
+    show_metrics_hud = False
+    metrics_hud_interval_sec = 1.0
+    metrics_hud_template = 'Frame {:.1f}/{:.1f} ms  Rescale {:.0f} ms  Load {:.0f} ms  Input {:.0f} ms'
+
+    black = pygame.color.Color('#000000')
+    white = pygame.color.Color('#FFFFFF')
+    transparency = (0, 0, 0, 0)
+
+    notify_downloading = 'Die Zeitung wird aus dem Briefkasten geholt...'
+    notify_progress = 'Fortschritt: {}%'
+    notify_first_page = 'Erste Seite erreicht'
+    notify_last_page = 'Letzte Seite erreicht'
+    notify_last_date = 'Heutiges Datum erreicht'
+    notify_bookmark = 'Lesezeichen gesetzt'
+    notify_unbookmark = 'Lesezeichen entfernt'
+    notify_new_entry = 'Neue Ausgabe eingetroffen'
+    notify_no_content = 'Für den {} existiert keine Ausgabe'
+    notify_loading = 'Seite wird geladen...'
+
+    wallpaper_path = 'data/wallpaper.png'
+
+    icon_downloading_path = 'data/doggo_news.png'
+    icon_downloading_vig_path = 'data/doggo_news_vignette.png'
+
+    icon_loading_path = 'data/doggo_fetch.png'
+    icon_loading_vig_path = 'data/doggo_fetch_vignette.png'
+
+    icon_empty_path = 'data/doggo_idle.png'
+    icon_empty_vig_path = 'data/doggo_idle_vignette.png'
+
+    insert_vignette_path = 'data/insert_vignette.png'
+    info_vignette_path = 'data/info_vignette.png'
+
+    FIRSTPAGE =  0
+    LASTPAGE =   1
+    LASTDATE =   2
+    BOOKMARK =   3
+    UNBOOKMARK = 4
+    NEWENTRY =   5
+
+    WAKEEVENT = pygame.USEREVENT
+
+
+    def __init__(self):
+
+        pygame.init()
+
+        if self.run_in_window:
+            self.screen = pygame.display.set_mode(self.window_size)
+        else:
+            self.screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
+
+        pygame.mouse.set_visible(False)
+
+        self.window_width, self.window_height = self.screen.get_size()
+        self.clock = pygame.time.Clock()
+
+        self.font = pygame.freetype.Font(self.font_file_path, size=self.font_notify_size)
+        self.hud_font = pygame.freetype.Font(self.font_file_path, size=self.font_hud_size)
+
+        self.wallpaper = pygame.image.load(self.wallpaper_path)
+
+        self.icon_downloading = pygame.image.load(self.icon_downloading_path)
+        self.icon_downloading_vig = pygame.image.load(self.icon_downloading_vig_path)
+
+        self.icon_loading = pygame.image.load(self.icon_loading_path)
+        self.icon_loading_vig = pygame.image.load(self.icon_loading_vig_path)
+
+        self.icon_empty = pygame.image.load(self.icon_empty_path)
+        self.icon_empty_vig = pygame.image.load(self.icon_empty_vig_path)
+
+        self.insert_vignette = pygame.image.load(self.insert_vignette_path)
+        self.info_vignette = pygame.image.load(self.info_vignette_path)
+
+        self.info_text = ('', '')
+        self.info_time = 0.0
+
+        self.info_surf = None
+        self.info_surf_rect = self.info_vignette.get_rect(topleft=(0, 0))
+
+        self.insert_text = ''
+        self.insert_time = 0.0
+
+        self.insert_surf = None
+        self.insert_surf_rect = self.insert_vignette.get_rect(center=(0.5 * self.window_width, 0.5 * self.window_height))
+
+        self.view_x = 0.0
+        self.view_y = 0.0
+
+        self.scale = 1.0
+
+        self.rescale_mode = 1
+        self.rescale_time = 0
+
+        self.low_res_image = None
+        self.high_res_image = None
+
+        self.low_res_image_width = 0
+        self.low_res_image_height = 0
+
+        self.high_res_image_width = 0
+        self.high_res_image_height = 0
+
+        self.page_pyramid = None
+
+        self.rescaled_tiles = {}
+        self.rescaled_level = None
+
+        self.rescaled_sets = collections.OrderedDict()
+        self.rescaled_sets_size = 0
+
+        self.page_load = None
+        self.page_load_dpi_ratio = 1.0
+        self.page_load_shown = False
+
+        self.draw_images = True
+
+        self.frame_dirty = True
+        self.dirty_rects = []
+
+        self.frame_panned = False
+        self.frame_origin = None
+
+        self.active_time = time.perf_counter()
+        self.input_active = False
+
+        self.info_alpha = 0
+        self.insert_alpha = 0
+
+        self.viewport_buffer = None
+        self.viewport_padding = math.ceil(self.max_scale)
+
+        self.viewport_key = None
+        self.viewport_rect = None
+
+        self.rescaled_set_buffer = None
+
+        self.page_load_time = 0.0
+        self.input_time = None
+
+        self.hud_surf = None
+        self.hud_surf_rect = pygame.Rect(0, 0, 0, 0)
+        self.hud_time = 0.0
+
+
+    def invalidate(self, rect=None):
+
+        if rect is None:
+            self.frame_dirty = True
+        else:
+            self.dirty_rects.append(rect)
+
+
+    def info_rect(self):
+
+        return self.info_surf_rect
+
+
+    def insert_rect(self):
+
+        return self.insert_surf_rect
+
+
+    def render_overlay(self, parts):
+
+        overlay_rect = parts[0][1].unionall([part_rect for part_surf, part_rect in parts[1:]])
+
+        overlay_surf = pygame.Surface(overlay_rect.size, flags=pygame.SRCALPHA)
+        overlay_surf.fill(self.transparency)
+
+        for part_surf, part_rect in parts:
+            overlay_surf.blit(part_surf, part_rect.move(-overlay_rect.left, -overlay_rect.top))
+
+        return overlay_surf, overlay_rect
+
+
+    def render_info(self):
+
+        screen_top_left = (15, 12)
+        screen_top_right = (self.window_width - 15, 12)
+
+        info_text_left, info_text_right = self.info_text
+        bar_rect_top_left = self.info_vignette.get_rect(topleft=(0, 0))
+
+        text_left_surf, text_left_rect = self.font.render(text=info_text_left, fgcolor=self.black)
+        text_left_rect_top_left = text_left_surf.get_rect(topleft=screen_top_left)
+
+        text_right_surf, text_right_rect = self.font.render(text=info_text_right, fgcolor=self.black)
+        text_right_rect_top_right = text_right_surf.get_rect(topright=screen_top_right)
+
+        self.invalidate(self.info_surf_rect)
+
+        self.info_surf, self.info_surf_rect = self.render_overlay([
+            (self.info_vignette, bar_rect_top_left),
+            (text_left_surf, text_left_rect_top_left),
+            (text_right_surf, text_right_rect_top_right)])
+
+        self.invalidate(self.info_surf_rect)
+
+
+    def render_insert(self):
+
+        screen_center = (0.5 * self.window_width, 0.5 * self.window_height)
+        bar_rect_center = self.insert_vignette.get_rect(center=screen_center)
+
+        text_surf, text_rect = self.font.render(text=self.insert_text, fgcolor=self.black)
+        text_rect_center = text_surf.get_rect(center=screen_center)
+
+        self.invalidate(self.insert_surf_rect)
+
+        self.insert_surf, self.insert_surf_rect = self.render_overlay([
+            (self.insert_vignette, bar_rect_center),
+            (text_surf, text_rect_center)])
+
+        self.invalidate(self.insert_surf_rect)
+
+
+    def display_info(self, info, time):
+
+        if info != self.info_text or self.info_surf is None:
+            self.info_text = info
+            self.render_info()
+
+        self.info_time = time
+
+        self.invalidate(self.info_rect())
+        self.clock.tick()
+
+
+    def clear_info(self):
+
+        self.info_time = 0.0
+        self.invalidate(self.info_rect())
+
+
+    def display_insert(self, insert, time):
+
+        if insert == self.FIRSTPAGE:
+            self.insert_text = self.notify_first_page
+
+        if insert == self.LASTPAGE:
+            self.insert_text = self.notify_last_page
+
+        if insert == self.LASTDATE:
+            self.insert_text = self.notify_last_date
+
+        if insert == self.BOOKMARK:
+            self.insert_text = self.notify_bookmark
+
+        if insert == self.UNBOOKMARK:
+            self.insert_text = self.notify_unbookmark
+
+        if insert == self.NEWENTRY:
+            self.insert_text = self.notify_new_entry
+
+        self.render_insert()
+        self.insert_time = time
+
+        self.invalidate(self.insert_rect())
+        self.clock.tick()
+
+
+    def display_no_content(self, date):
+
+        date_str = date.strftime('%d.%m.%Y')
+        no_content_str = self.notify_no_content.format(date_str)
+
+        self.insert_text = no_content_str
+        self.render_insert()
+
+        self.insert_time = math.inf
+
+        self.invalidate(self.insert_rect())
+
+
+    def clear_insert(self):
+
+        self.insert_time = 0.0
+        self.invalidate(self.insert_rect())
+
+
+    def draw_loading(self, invert):
+
+        if invert:
+            self.screen.fill(self.black)
+
+        screen_center = (0.5 * self.window_width, 0.5 * self.window_height)
+        screen_below = (0.5 * self.window_width, 0.5 * self.window_height + 250)
+
+        text_color = self.white if invert else self.black
+        notify_surf, notify_rect = self.font.render(text=self.notify_loading, fgcolor=text_color)
+
+        notify_rect_center = notify_surf.get_rect(center=screen_center)
+        icon_rect_center = self.icon_loading.get_rect(center=screen_below)
+
+        if not invert:
+            bar_rect_center = self.insert_vignette.get_rect(center=screen_center)
+
+            self.screen.blit(self.insert_vignette, bar_rect_center)
+            self.screen.blit(self.icon_loading_vig, icon_rect_center)
+
+        self.screen.blit(notify_surf, notify_rect_center)
+        self.screen.blit(self.icon_loading, icon_rect_center)
+
+
+    def download_screen(self, perc):
+
+        self.screen.fill(self.black)
+
+        screen_center = (0.5 * self.window_width, 0.5 * self.window_height)
+        screen_newline = (0.5 * self.window_width, 0.5 * self.window_height + 40)
+        screen_below = (0.5 * self.window_width, 0.5 * self.window_height + 250)
+
+        notify_surf, notify_rect = self.font.render(text=self.notify_downloading, fgcolor=self.white)
+        notify_rect_center = notify_surf.get_rect(center=screen_center)
+        self.screen.blit(notify_surf, notify_rect_center)
+
+        percentage_str = self.notify_progress.format(perc)
+        perc_surf, perc_rect = self.font.render(percentage_str, fgcolor=self.white)
+        perc_rect_center = perc_surf.get_rect(center=screen_newline)
+        self.screen.blit(perc_surf, perc_rect_center)
+
+        icon_rect_center = self.icon_downloading.get_rect(center=screen_below)
+        self.screen.blit(self.icon_downloading, icon_rect_center)
+
+        pygame.display.flip()
+
+        for event in pygame.event.get():
+            pass
+
+
+    def set_draw_images(self, draw):
+
+        if draw != self.draw_images:
+            print(f'Image drawing {"enabled" if draw else "disabled"}')
+
+            self.invalidate()
+
+        self.draw_images = draw
+
+
+    def get_draw_images(self):
+
+        return self.draw_images
+
+
+    def load_images(self, page_load, dpi_ratio):
+
+        if self.page_load:
+            self.page_load.cancel()
+
+        self.page_load = page_load
+        self.page_load_dpi_ratio = dpi_ratio
+        self.page_load_shown = False
+
+        self.page_load_time = time.perf_counter()
+
+        page_load.low_res.add_done_callback(self.wake_callback)
+        page_load.high_res.add_done_callback(self.wake_callback)
+
+        self.invalidate()
+        self.poll_images()
+
+
+    def poll_images(self):
+
+        if not self.page_load:
+            return
+
+        for page_future in (self.page_load.low_res, self.page_load.high_res):
+
+            if page_future.done() and page_future.exception():
+                print(f'Page {self.page_load.key} could not be loaded')
+
+                self.page_load = None
+                return
+
+        if not self.page_load_shown and self.page_load.low_res.done():
+
+            self.set_low_res(self.page_load.low_res.result(), self.page_load_dpi_ratio)
+            self.page_load_shown = True
+
+        if self.page_load.high_res.done():
+
+            self.set_high_res(self.page_load.high_res.result())
+            self.page_load = None
+
+            PerformanceMetrics.record('page_load_ms', 1000 * (time.perf_counter() - self.page_load_time))
+
+
+    def set_images(self, low_res_image, high_res_image, dpi_ratio):
+
+        self.set_low_res(low_res_image, dpi_ratio)
+        self.set_high_res(high_res_image)
+
+
+    def set_low_res(self, low_res_image, dpi_ratio):
+
+        self.low_res_image = low_res_image
+        self.high_res_image = None
+
+        self.low_res_image_width = self.low_res_image.get_width()
+        self.low_res_image_height = self.low_res_image.get_height()
+
+        self.dpi_ratio = dpi_ratio
+
+        RescaleWorker.abort()
+
+        self.page_pyramid = None
+
+        self.rescaled_tiles = {}
+        self.rescaled_level = None
+
+        self.rescaled_sets.clear()
+        self.rescaled_sets_size = 0
+
+        self.initial_view()
+        self.invalidate()
+
+        self.rescale_mode = 1
+        self.rescale_time = 0
+
+
+    def set_high_res(self, high_res_image):
+
+        self.high_res_image = high_res_image
+
+        self.high_res_image_width = self.high_res_image.get_width()
+        self.high_res_image_height = self.high_res_image.get_height()
+
+        self.page_pyramid = PagePyramid(self.high_res_image)
+
+        self.rescale_mode = 1
+        self.rescale_time = 0
+
+
+    def initial_view(self):
+
+        if self.low_res_image_width * self.scale > self.window_width:
+            self.view_x = 0.5 * self.window_width / self.scale
+        else:
+            self.view_x = 0.5 * self.low_res_image_width
+
+        if self.low_res_image_height * self.scale > self.window_height:
+            self.view_y = 0.5 * self.window_height / self.scale
+        else:
+            self.view_y = 0.5 * self.low_res_image_height
+
+
+    def set_center(self, px, py):
+
+        view = (self.view_x, self.view_y)
+
+        self.view_x = px
+        self.view_y = py
+
+        if px < 0:
+            self.view_x = 0.0
+        if py < 0:
+            self.view_y = 0.0
+
+        if px > self.low_res_image_width:
+            self.view_x = self.low_res_image_width
+        if py > self.low_res_image_height:
+            self.view_y = self.low_res_image_height
+
+        # Panning alone lets the next frame be scrolled instead of composed in full
+        if (self.view_x, self.view_y) != view:
+            self.frame_panned = True
+
+
+    def move_center(self, dx, dy):
+
+        new_view_x = self.view_x + dx
+        new_view_y = self.view_y + dy
+
+        self.set_center(new_view_x, new_view_y)
+
+
+    def set_scale(self, scale):
+
+        if scale < self.min_scale:
+            scale = self.min_scale
+        if scale > self.max_scale:
+            scale = self.max_scale
+
+        if scale != self.scale:
+            self.scale = scale
+
+            RescaleWorker.abort()
+            self.stash_rescaled()
+
+            self.invalidate()
+
+            self.rescale_mode = 1
+            self.rescale_time = time.time()
+
+
+    def change_scale(self, factor):
+
+        self.set_scale(self.scale * factor)
+
+
+    def page_origin(self):
+
+        origin_x = round(0.5 * self.window_width - self.view_x * self.scale)
+        origin_y = round(0.5 * self.window_height - self.view_y * self.scale)
+
+        return origin_x, origin_y
+
+
+    def page_rect(self, origin):
+
+        page_width = math.ceil(self.low_res_image_width * self.scale)
+        page_height = math.ceil(self.low_res_image_height * self.scale)
+
+        return pygame.Rect(origin[0], origin[1], page_width, page_height)
+
+
+    def visible_area(self, margin=0):
+
+        origin_x, origin_y = self.page_origin()
+        return -origin_x - margin, -origin_y - margin, self.window_width - origin_x + margin, self.window_height - origin_y + margin
+
+
+    def rescale_done(self, level_image, level_factor, scale, rescaled_tiles):
+
+        self.rescaled_tiles = rescaled_tiles
+        self.rescaled_level = (level_image, level_factor, scale)
+
+        self.rescale_mode = 0
+        self.invalidate()
+
+        self.wake()
+
+
+    def tiles_complete(self):
+
+        if not self.rescaled_level:
+            return False
+
+        level_image, level_factor, scale = self.rescaled_level
+        if scale != self.scale:
+            return False
+
+        visible_tiles = self.page_pyramid.tile_range(level_image, level_factor, *self.visible_area())
+        return all(tile in self.rescaled_tiles for tile in visible_tiles)
+
+
+    def draw_tiles(self):
+
+        level_image, level_factor, scale = self.rescaled_level
+        if scale != self.scale:
+            return
+
+        origin_x, origin_y = self.page_origin()
+
+        for tile in self.page_pyramid.tile_range(level_image, level_factor, *self.visible_area()):
+
+            if tile not in self.rescaled_tiles:
+                continue
+
+            tile_surf, tile_dest = self.rescaled_tiles[tile]
+            self.screen.blit(tile_surf, dest=(origin_x + tile_dest.left, origin_y + tile_dest.top))
+
+
+    def update_viewport(self):
+
+        # Scale straight into a persistent buffer with the low-res page format
+        buffer_size = (self.window_width + 2 * self.viewport_padding, self.window_height + 2 * self.viewport_padding)
+        buffer_format = (self.low_res_image.get_bitsize(), self.low_res_image.get_masks())
+
+        if self.viewport_buffer is None or self.viewport_key[0] != buffer_format:
+            self.viewport_buffer = pygame.Surface(buffer_size, self.low_res_image.get_flags() & pygame.SRCALPHA, self.low_res_image)
+
+        self.viewport_key = (buffer_format, self.low_res_image, self.view_x, self.view_y, self.scale)
+        self.viewport_rect = None
+
+        low_res_rects = self.low_res_rects(self.screen.get_rect())
+        if low_res_rects is None:
+            return
+
+        source_rect, dest_rect = low_res_rects
+
+        source_surf = self.low_res_image.subsurface(source_rect)
+        dest_surf = self.viewport_buffer.subsurface(dest_rect.move(self.viewport_padding, self.viewport_padding))
+
+        pygame.transform.scale(source_surf, dest_rect.size, dest_surf)
+        self.viewport_rect = dest_rect
+
+
+    def low_res_rects(self, screen_rect):
+
+        origin_x, origin_y = self.page_origin()
+
+        left = screen_rect.left - origin_x
+        top = screen_rect.top - origin_y
+
+        right = screen_rect.right - origin_x
+        bottom = screen_rect.bottom - origin_y
+
+        source_left = max(0, math.floor(left / self.scale))
+        source_top = max(0, math.floor(top / self.scale))
+
+        source_right = min(self.low_res_image_width, math.ceil(right / self.scale))
+        source_bottom = min(self.low_res_image_height, math.ceil(bottom / self.scale))
+
+        if source_right <= source_left or source_bottom <= source_top:
+            return None
+
+        dest_left = round(origin_x + source_left * self.scale)
+        dest_top = round(origin_y + source_top * self.scale)
+
+        dest_right = round(origin_x + source_right * self.scale)
+        dest_bottom = round(origin_y + source_bottom * self.scale)
+
+        if dest_right <= dest_left or dest_bottom <= dest_top:
+            return None
+
+        source_rect = pygame.Rect(source_left, source_top, source_right - source_left, source_bottom - source_top)
+        dest_rect = pygame.Rect(dest_left, dest_top, dest_right - dest_left, dest_bottom - dest_top)
+
+        return source_rect, dest_rect
+
+
+    def scale_key(self, scale):
+
+        return round(math.log2(scale) * self.rescale_cache_steps)
+
+
+    def rescaled_set_size(self, rescaled_tiles):
+
+        return sum(tile_surf.get_pitch() * tile_surf.get_height() for tile_surf, tile_dest in rescaled_tiles.values())
+
+
+    def stash_rescaled(self):
+
+        if not self.rescaled_level or not self.rescaled_tiles:
+            return
+
+        level_image, level_factor, scale = self.rescaled_level
+        scale_key = self.scale_key(scale)
+
+        if scale_key in self.rescaled_sets:
+            replaced_tiles, replaced_scale = self.rescaled_sets.pop(scale_key)
+            self.rescaled_sets_size -= self.rescaled_set_size(replaced_tiles)
+
+        self.rescaled_sets[scale_key] = (self.rescaled_tiles, scale)
+        self.rescaled_sets_size += self.rescaled_set_size(self.rescaled_tiles)
+
+        while self.rescaled_sets_size > self.rescale_cache_budget and len(self.rescaled_sets) > 1:
+
+            evicted_key, (evicted_tiles, evicted_scale) = self.rescaled_sets.popitem(last=False)
+            self.rescaled_sets_size -= self.rescaled_set_size(evicted_tiles)
+
+
+    def draw_rescaled_set(self):
+
+        if not self.rescaled_sets:
+            return
+
+        scale_key = self.scale_key(self.scale)
+        nearest_key = min(self.rescaled_sets, key=lambda key: abs(key - scale_key))
+
+        self.rescaled_sets.move_to_end(nearest_key)
+        rescaled_tiles, scale = self.rescaled_sets[nearest_key]
+
+        factor = self.scale / scale
+
+        # Sets too far from the current scale look no better than the low-res viewport
+        if not 1 / self.rescale_cache_ratio_max <= factor <= self.rescale_cache_ratio_max:
+            return
+
+        origin_x, origin_y = self.page_origin()
+
+        window_rect = self.screen.get_clip()
+
+        for tile_surf, tile_dest in rescaled_tiles.values():
+
+            left = round(tile_dest.left * factor)
+            top = round(tile_dest.top * factor)
+
+            right = round(tile_dest.right * factor)
+            bottom = round(tile_dest.bottom * factor)
+
+            dest_rect = pygame.Rect(origin_x + left, origin_y + top, right - left, bottom - top)
+
+            visible_rect = dest_rect.clip(window_rect)
+            if visible_rect.width == 0 or visible_rect.height == 0:
+                continue
+
+            self.draw_rescaled_part(tile_surf, dest_rect, visible_rect)
+
+
+    def draw_rescaled_part(self, tile_surf, dest_rect, visible_rect):
+
+        tile_width, tile_height = tile_surf.get_size()
+
+        scale_x = dest_rect.width / tile_width
+        scale_y = dest_rect.height / tile_height
+
+        # Source pixels covering the visible part, widened to whole pixels
+        source_left = math.floor((visible_rect.left - dest_rect.left) / scale_x)
+        source_top = math.floor((visible_rect.top - dest_rect.top) / scale_y)
+
+        source_right = min(tile_width, math.ceil((visible_rect.right - dest_rect.left) / scale_x))
+        source_bottom = min(tile_height, math.ceil((visible_rect.bottom - dest_rect.top) / scale_y))
+
+        part_left = dest_rect.left + round(source_left * scale_x)
+        part_top = dest_rect.top + round(source_top * scale_y)
+
+        part_right = dest_rect.left + round(source_right * scale_x)
+        part_bottom = dest_rect.top + round(source_bottom * scale_y)
+
+        part_size = (part_right - part_left, part_bottom - part_top)
+        if part_size[0] <= 0 or part_size[1] <= 0:
+            return
+
+        # Scale into a persistent buffer instead of allocating a surface per tile and frame
+        buffer_format = (tile_surf.get_bitsize(), tile_surf.get_masks())
+        buffer_padding = 2 * math.ceil(self.rescale_cache_ratio_max)
+        buffer_size = (self.window_width + 2 * buffer_padding, self.window_height + 2 * buffer_padding)
+
+        if part_size[0] > buffer_size[0] or part_size[1] > buffer_size[1]:
+            return
+
+        if self.rescaled_set_buffer is None or self.rescaled_set_buffer[0] != buffer_format:
+            self.rescaled_set_buffer = (buffer_format, pygame.Surface(buffer_size, tile_surf.get_flags() & pygame.SRCALPHA, tile_surf))
+
+        part_surf = self.rescaled_set_buffer[1].subsurface((0, 0) + part_size)
+        source_rect = pygame.Rect(source_left, source_top, source_right - source_left, source_bottom - source_top)
+
+        pygame.transform.scale(tile_surf.subsurface(source_rect), part_size, part_surf)
+        self.screen.blit(part_surf, (part_left, part_top))
+
+
+    def draw_low_res(self):
+
+        buffer_format = (self.low_res_image.get_bitsize(), self.low_res_image.get_masks())
+        viewport_key = (buffer_format, self.low_res_image, self.view_x, self.view_y, self.scale)
+
+        clip_rect = self.screen.get_clip()
+
+        # Strips exposed by scrolling scale only their own part instead of the whole viewport
+        if viewport_key != self.viewport_key and clip_rect != self.screen.get_rect():
+
+            low_res_rects = self.low_res_rects(clip_rect)
+            if low_res_rects is None:
+                return
+
+            source_rect, dest_rect = low_res_rects
+            self.screen.blit(pygame.transform.scale(self.low_res_image.subsurface(source_rect), dest_rect.size), dest_rect)
+
+            return
+
+        if viewport_key != self.viewport_key:
+            self.update_viewport()
+
+        if self.viewport_rect is None:
+            return
+
+        buffer_area = self.viewport_rect.move(self.viewport_padding, self.viewport_padding)
+        self.screen.blit(self.viewport_buffer, self.viewport_rect, area=buffer_area)
+
+
+    def update_overlays(self, dt):
+
+        if self.info_time > 0:
+            self.info_time = (self.info_time - dt) if self.info_time > dt else 0.0
+
+        if self.insert_time > 0:
+            self.insert_time = (self.insert_time - dt) if self.insert_time > dt else 0.0
+
+        info_alpha = round(255 * (1.0 - math.exp(-self.overlay_fade_exp * self.info_time)))
+        insert_alpha = round(255 * (1.0 - math.exp(-self.overlay_fade_exp * self.insert_time)))
+
+        if info_alpha != self.info_alpha:
+            self.info_alpha = info_alpha
+            self.invalidate(self.info_rect())
+
+        if insert_alpha != self.insert_alpha:
+            self.insert_alpha = insert_alpha
+            self.invalidate(self.insert_rect())
+
+
+    def mark_input(self, input_time=None):
+
+        if self.input_time is None:
+            self.input_time = input_time if input_time is not None else time.perf_counter()
+
+
+    def render_hud(self):
+
+        hud_text = self.metrics_hud_template.format(
+            PerformanceMetrics.percentile('frame_ms', 0.5),
+            PerformanceMetrics.percentile('frame_ms', 0.95),
+            PerformanceMetrics.percentile('rescale_ms', 0.95),
+            PerformanceMetrics.percentile('page_load_ms', 0.95),
+            PerformanceMetrics.percentile('input_latency_ms', 0.95))
+
+        self.invalidate(self.hud_surf_rect)
+
+        self.hud_surf, hud_rect = self.hud_font.render(text=hud_text, fgcolor=self.white, bgcolor=self.black)
+        self.hud_surf_rect = self.hud_surf.get_rect(bottomleft=(0, self.window_height))
+
+        self.invalidate(self.hud_surf_rect)
+
+
+    def overlay_rects(self):
+
+        overlay_rects = []
+
+        if self.info_alpha > 0:
+            overlay_rects.append(self.info_surf_rect)
+
+        if self.insert_alpha > 0:
+            overlay_rects.append(self.insert_surf_rect)
+
+        if self.show_metrics_hud and self.hud_surf is not None:
+            overlay_rects.append(self.hud_surf_rect)
+
+        return overlay_rects
+
+
+    def scroll_frame(self):
+
+        # Only a settled page view can be shifted, anything else is composed in full
+        if self.frame_origin is None or not self.draw_images or self.low_res_image is None:
+            return None
+
+        if self.page_load and not self.page_load_shown:
+            return None
+
+        origin_x, origin_y = self.page_origin()
+
+        dx = origin_x - self.frame_origin[0]
+        dy = origin_y - self.frame_origin[1]
+
+        window_rect = self.screen.get_rect()
+        if abs(dx) >= self.window_width or abs(dy) >= self.window_height:
+            return None
+
+        old_page_rect = self.page_rect(self.frame_origin)
+        new_page_rect = self.page_rect((origin_x, origin_y))
+
+        valid_rect = window_rect.clip(old_page_rect).move(dx, dy).clip(new_page_rect).clip(window_rect)
+
+        overlay_rects = self.overlay_rects()
+
+        self.screen.scroll(dx, dy)
+        self.frame_origin = (origin_x, origin_y)
+
+        if valid_rect.width == 0 or valid_rect.height == 0:
+            return [window_rect]
+
+        exposed_rects = [
+            pygame.Rect(0, 0, self.window_width, valid_rect.top),
+            pygame.Rect(0, valid_rect.bottom, self.window_width, self.window_height - valid_rect.bottom),
+            pygame.Rect(0, valid_rect.top, valid_rect.left, valid_rect.height),
+            pygame.Rect(valid_rect.right, valid_rect.top, self.window_width - valid_rect.right, valid_rect.height)]
+
+        # Overlays were shifted along with the page and have to be redrawn in place
+        for overlay_rect in overlay_rects:
+            exposed_rects += [overlay_rect.move(dx, dy).clip(window_rect), overlay_rect]
+
+        PerformanceMetrics.count('frames_scrolled')
+
+        return [exposed_rect for exposed_rect in exposed_rects if exposed_rect.width > 0 and exposed_rect.height > 0]
+
+
+    def wake(self):
+
+        # Posting is thread safe and ends an idle wait right away
+        pygame.event.post(pygame.event.Event(self.WAKEEVENT))
+
+
+    def wake_callback(self, future):
+
+        self.wake()
+
+
+    def frame_delay(self, presented):
+
+        frame_time = time.perf_counter()
+
+        if presented or self.input_active:
+            self.active_time = frame_time
+
+        if frame_time - self.active_time < self.idle_after_sec:
+            delay_sec = 1.0 / self.active_fps
+        else:
+            delay_sec = 1.0 / self.idle_fps
+
+        # Wake up in time for a pending rescale and for overlays that start to fade
+        if self.rescale_mode == 1 and self.draw_images and self.page_pyramid is not None:
+            delay_sec = min(delay_sec, max(0.0, self.rescale_time + self.rescale_wait_sec - time.time()))
+
+        overlay_time = max(self.info_time, self.insert_time)
+        if 0 < overlay_time < math.inf:
+
+            fade_ms = math.log(2 * 255) / self.overlay_fade_exp
+            delay_sec = min(delay_sec, max(1.0 / self.active_fps, (overlay_time - fade_ms) / 1000))
+
+        return delay_sec
+
+
+    def pace(self, presented, frame_start):
+
+        delay_ms = round(1000 * (self.frame_delay(presented) - (time.perf_counter() - frame_start)))
+
+        # Any input or wake event ends the wait early
+        if delay_ms > 0:
+
+            wait_time = time.perf_counter()
+            pygame.event.wait(delay_ms)
+
+            PerformanceMetrics.record('frame_wait_ms', 1000 * (time.perf_counter() - wait_time))
+
+
+    def compose(self, clip_rect):
+
+        self.screen.set_clip(clip_rect)
+
+        # Draw background
+        self.screen.blit(self.wallpaper, dest=(0, 0))
+
+        # Draw newspaper
+
+        if self.draw_images and self.low_res_image is not None:
+
+            if self.rescale_mode != 0:
+                self.draw_low_res()
+                self.draw_rescaled_set()
+
+            if self.rescaled_tiles:
+                self.draw_tiles()
+
+        # Draw loading notice
+
+        if self.draw_images and self.page_load and not self.page_load_shown:
+            self.draw_loading(invert=self.low_res_image is None)
+
+        # Draw info text
+
+        if self.info_alpha > 0:
+
+            self.info_surf.set_alpha(self.info_alpha)
+            self.screen.blit(self.info_surf, self.info_surf_rect)
+
+        # Draw text insert
+
+        if self.insert_alpha > 0:
+
+            self.insert_surf.set_alpha(self.insert_alpha)
+            self.screen.blit(self.insert_surf, self.insert_surf_rect)
+
+        # Draw metrics
+
+        if self.show_metrics_hud and self.hud_surf is not None:
+            self.screen.blit(self.hud_surf, self.hud_surf_rect)
+
+        self.screen.set_clip(None)
+
+
+    def draw(self):
+
+        self.clock.tick()
+        dt = self.clock.get_time()
+
+        start_time = time.perf_counter()
+
+        self.poll_images()
+
+        if self.draw_images and self.low_res_image is not None:
+
+            # Rescale image
+
+            if self.rescale_mode == 1 and self.page_pyramid is not None:
+
+                current_time = time.time()
+                if (current_time - self.rescale_time) > self.rescale_wait_sec:
+
+                    self.rescale_mode = 2
+                    RescaleWorker(self)
+
+            if self.rescale_mode == 0 and not self.tiles_complete():
+
+                self.rescale_mode = 1
+                self.rescale_time = time.time()
+
+        self.update_overlays(dt)
+
+        if self.show_metrics_hud and (start_time - self.hud_time) > self.metrics_hud_interval_sec:
+
+            self.hud_time = start_time
+            self.render_hud()
+
+        # Only composite what changed since the last frame, rescale_done invalidates under the same mutex
+
+        RescaleWorker.mutex.acquire()
+
+        frame_dirty = self.frame_dirty
+        dirty_rects = self.dirty_rects
+        frame_panned = self.frame_panned
+
+        self.frame_dirty = False
+        self.dirty_rects = []
+        self.frame_panned = False
+
+        RescaleWorker.mutex.release()
+
+        # A pure pan shifts the last frame and only composes the strips it exposed
+        if frame_panned and not frame_dirty:
+
+            exposed_rects = self.scroll_frame()
+
+            if exposed_rects is None:
+                frame_dirty = True
+            else:
+                dirty_rects = exposed_rects + dirty_rects
+
+        if frame_dirty:
+
+            self.compose(None)
+            pygame.display.flip()
+
+            self.frame_origin = self.page_origin()
+
+        elif dirty_rects:
+
+            for dirty_rect in dirty_rects:
+                self.compose(dirty_rect)
+
+            if frame_panned:
+                pygame.display.flip()
+            else:
+                pygame.display.update(dirty_rects)
+
+        if (frame_dirty or dirty_rects) and self.input_time is not None:
+
+            PerformanceMetrics.record('input_latency_ms', 1000 * (time.perf_counter() - self.input_time))
+            self.input_time = None
+
+        if frame_dirty or dirty_rects:
+            PerformanceMetrics.record('draw_ms', 1000 * (time.perf_counter() - start_time))
+
+        # Handle events
+        for event in pygame.event.get():
+            pass
+
+        # Frame time covers compose and flip, the pacing wait is recorded on its own
+        PerformanceMetrics.record('frame_ms', 1000 * (time.perf_counter() - start_time))
+
+        self.pace(frame_dirty or bool(dirty_rects), start_time)
+
+        return dt
+
+
+
+class ArchiveMember:
+
+    def __init__(self, page_store, entry, name):
+
+        self.page_store = page_store
+
+        self.entry = entry
+        self.name = name
+
+
+    def open(self):
+
+        member_data = self.page_store.read_member(self.entry, self.name)
+        return io.BytesIO(member_data)
+
+
+
+class ArchiveHandle:
+
+    def __init__(self, archive_file):
+
+        self.archive_file = archive_file
+        self.mutex = threading.Lock()
+
+        self.readers = 0
+        self.retired = False
+
+
+
+class ArchivePageStore:
+
+    open_archives_max = 4
+
+
+    def __init__(self, archives_folder, archive_key_start):
+
+        self.archives_folder = archives_folder
+        self.archive_key_start = archive_key_start
+
+        self.archives = collections.OrderedDict()
+        self.mutex = threading.Lock()
+
+
+    def archive_path(self, entry):
+
+        return os.path.join(self.archives_folder, f'{entry}.zip')
+
+
+    def archive_password(self, entry):
+
+        archive_key = (self.archive_key_start + entry).encode()
+        archive_pw = hashlib.md5(archive_key).hexdigest().encode()
+
+        return archive_pw
+
+
+    def has_entry(self, entry):
+
+        return os.path.isfile(self.archive_path(entry))
+
+
+    def open_archive(self, path, entry):
+
+        archive_file = pyzipper.AESZipFile(path, 'r')
+        archive_file.setpassword(self.archive_password(entry))
+
+        return archive_file
+
+
+    def get_archive(self, entry):
+
+        self.mutex.acquire()
+
+        try:
+            if entry in self.archives:
+                self.archives.move_to_end(entry)
+                archive = self.archives[entry]
+
+            else:
+                # Reading the central directory happens once per opened archive
+                archive = ArchiveHandle(self.open_archive(self.archive_path(entry), entry))
+                self.archives[entry] = archive
+
+                while len(self.archives) > self.open_archives_max:
+
+                    evicted_entry, evicted_archive = self.archives.popitem(last=False)
+                    self.retire_archive(evicted_archive)
+
+            # Evicted archives stay open until their last reader is done
+            archive.readers += 1
+
+        finally:
+            self.mutex.release()
+
+        return archive
+
+
+    def release_archive(self, archive):
+
+        self.mutex.acquire()
+
+        archive.readers -= 1
+        if archive.retired and archive.readers == 0:
+            archive.archive_file.close()
+
+        self.mutex.release()
+
+
+    def retire_archive(self, archive):
+
+        archive.retired = True
+        if archive.readers == 0:
+            archive.archive_file.close()
+
+
+    def read_member(self, entry, name):
+
+        archive = self.get_archive(entry)
+
+        archive.mutex.acquire()
+        try:
+            member_data = archive.archive_file.read(name)
+        finally:
+            archive.mutex.release()
+            self.release_archive(archive)
+
+        return member_data
+
+
+    def member(self, entry, name):
+
+        return ArchiveMember(self, entry, name)
+
+
+    def close_entry(self, entry):
+
+        self.mutex.acquire()
+
+        archive = self.archives.pop(entry, None)
+        if archive:
+            self.retire_archive(archive)
+
+        self.mutex.release()
+
+
+
+class DatabaseStore:
+
+    flush_delay_sec = 2.0
+    compact_threshold = 500
+    compact_threshold_bytes = 256 * 1024
+
+
+    def __init__(self, path):
+
+        self.path = path
+        self.journal_path = path + '.journal'
+
+        self.pending = {}
+        self.journal_count = 0
+        self.journal_size = 0
+
+        # Only pending changes are guarded by mutex, so put never waits for the disk
+        self.mutex = threading.Lock()
+        self.write_mutex = threading.Lock()
+        self.flush_event = threading.Event()
+
+        if os.path.isfile(self.path):
+            with open(self.path, 'r') as database_file:
+                self.database = json.load(database_file)
+        else:
+            self.database = {'bookmark': {}, 'newspaper': {}}
+
+        self.replay_journal()
+
+        self.th = threading.Thread(target=self.flusher, daemon=True)
+        self.th.start()
+
+
+    def replay_journal(self):
+
+        if not os.path.isfile(self.journal_path):
+            return
+
+        journal_size = os.path.getsize(self.journal_path)
+
+        with open(self.journal_path, 'rb') as journal_file:
+            for journal_line in journal_file:
+
+                # A torn last line is left behind if power was lost mid-append
+                try:
+                    if not journal_line.endswith(b'\n'):
+                        raise ValueError('missing line end')
+
+                    change = json.loads(journal_line)
+
+                except ValueError:
+                    print('Ignoring incomplete database journal line')
+                    break
+
+                self.apply(self.database, change['table'], change['key'], change['value'])
+
+                self.journal_count += 1
+                self.journal_size += len(journal_line)
+
+        # Later appends would otherwise follow the torn bytes and be lost on replay
+        if self.journal_size < journal_size:
+            os.truncate(self.journal_path, self.journal_size)
+
+        print(f'Replayed {self.journal_count} database journal entries')
+
+
+    def apply(self, database, table, key, value):
+
+        if value is None:
+            database[table].pop(key, None)
+        else:
+            database[table][key] = value
+
+
+    def put(self, table, key, value):
+
+        change = json.dumps({'table': table, 'key': key, 'value': value})
+
+        self.mutex.acquire()
+        self.pending[(table, key)] = change
+        self.mutex.release()
 
-    def __init__(self, viewer):
+        self.flush_event.set()
 
-        self.viewer = viewer
 
-        self.allowed = True
-        self.mutex = threading.Lock()
+    def flusher(self):
 
-        self.th = threading.Thread(target=self.worker)
-        self.th.start()
+        while True:
 
-        self.instances.insert(0, self)
+            self.flush_event.wait()
 
+            # Debounce bursts of changes such as fast page turning
+            while self.flush_event.is_set():
 
-    def worker(self):
+                self.flush_event.clear()
+                time.sleep(self.flush_delay_sec)
 
-        rescale_width = self.viewer.high_res_image_width * self.viewer.scale * self.viewer.dpi_ratio
-        rescale_height = self.viewer.high_res_image_height * self.viewer.scale * self.viewer.dpi_ratio
+            self.flush()
 
-        rescaled_img = pygame.transform.smoothscale(self.viewer.high_res_image, (rescale_width, rescale_height))
+
+    def flush(self):
+
+        self.write_mutex.acquire()
+        start_time = time.perf_counter()
 
         self.mutex.acquire()
-        if self.allowed:
-            self.viewer.rescaled_image = rescaled_img
-            self.viewer.rescale_mode = 0
+
+        pending = self.pending
+        self.pending = {}
+
         self.mutex.release()
 
-        self.instances.remove(self)
+        if pending:
+            print(f'Writing {len(pending)} changes to database')
 
+            with open(self.journal_path, 'a') as journal_file:
+                for change in pending.values():
+                    journal_file.write(change + '\n')
+                    self.journal_size += len(change) + 1
 
-    def cancel(self):
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
 
-        self.mutex.acquire()
-        self.allowed = False
-        self.mutex.release()
+            for change in pending.values():
 
+                change = json.loads(change)
+                self.apply(self.database, change['table'], change['key'], change['value'])
 
-    def abort():
+            self.journal_count += len(pending)
 
-        if RescaleWorker.instances:
-            RescaleWorker.instances[0].cancel()
+        if self.journal_count > self.compact_threshold or self.journal_size > self.compact_threshold_bytes:
+            self.compact()
 
+        if pending:
+            PerformanceMetrics.record('database_write_ms', 1000 * (time.perf_counter() - start_time))
 
+        self.write_mutex.release()
 
-class ImageViewer:
 
-    run_in_window = True
-    window_size = (800, 1280)
+    def compact(self):
 
-    min_scale = 1.0
-    max_scale = 10.0
+        database_tmp_path = self.path + '.tmp'
 
-    rescale_wait_sec = 0.5
-    overlay_fade_exp = 0.01
+        with open(database_tmp_path, 'w') as database_file:
 
-    font_file_path = 'data/Ubuntu-B.ttf'
-    font_notify_size = 30
+            json.dump(self.database, database_file)
 
-    black = pygame.color.Color('#000000')
-    white = pygame.color.Color('#FFFFFF')
-    transparency = (0, 0, 0, 0)
+            database_file.flush()
+            os.fsync(database_file.fileno())
 
-    notify_downloading = 'Die Zeitung wird aus dem Briefkasten geholt...'
-    notify_progress = 'Fortschritt: {}%'
-    notify_first_page = 'Erste Seite erreicht'
-    notify_last_page = 'Letzte Seite erreicht'
-    notify_last_date = 'Heutiges Datum erreicht'
-    notify_bookmark = 'Lesezeichen gesetzt'
-    notify_unbookmark = 'Lesezeichen entfernt'
-    notify_no_content = 'Für den {} existiert keine Ausgabe'
-    notify_loading = 'Seite wird geladen...'
+        os.replace(database_tmp_path, self.path)
 
-    wallpaper_path = 'data/wallpaper.png'
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
 
-    icon_downloading_path = 'data/doggo_news.png'
-    icon_downloading_vig_path = 'data/doggo_news_vignette.png'
+        self.journal_count = 0
+        self.journal_size = 0
 
-    icon_loading_path = 'data/doggo_fetch.png'
-    icon_loading_vig_path = 'data/doggo_fetch_vignette.png'
 
-    icon_empty_path = 'data/doggo_idle.png'
-    icon_empty_vig_path = 'data/doggo_idle_vignette.png'
+    def load(self):
 
-    insert_vignette_path = 'data/insert_vignette.png'
-    info_vignette_path = 'data/info_vignette.png'
+        self.write_mutex.acquire()
+        database = copy.deepcopy(self.database)
+        self.write_mutex.release()
 
-    FIRSTPAGE =  0
-    LASTPAGE =   1
-    LASTDATE =   2
-    BOOKMARK =   3
-    UNBOOKMARK = 4
+        return database
+
+
+
+class ArchiveManager:
+
+    history_days = 1
+
+    parallel_downloads = 3
+    download_chunk_size = 256 * 1024
+
+    sync_interval_sec = 900
+    sync_rate_limit = 512 * 1024
+    sync_niceness = 10
+
+    retention_days = 60
+    retention_budget = 8 * 1024 * 1024 * 1024
+    retention_interval_sec = 300
+    retention_step_sec = 1.0
+
+    request_timeout_sec = (3.05, 30)
+
+    database_path = 'database.json'
+    credentials_path = 'credentials.yaml'
+    index_cache_path = 'index.json'
+
+    downloads_folder = 'downloads'
+    archives_folder = 'archives'
+    renderings_folder = 'renderings'
+
+    entry_info_template = '{} vom {}'
+    page_info_template = 'Seite {}'
+
+    NAVIGATE_CALENDAR = 0
+    NAVIGATE_EDITIONS = 1
+
+    entry_navigation = NAVIGATE_CALENDAR
 
 
     def __init__(self):
 
-        pygame.init()
+        self.online_archives = []
+        self.missing_archives = []
 
-        if self.run_in_window:
-            self.screen = pygame.display.set_mode(self.window_size)
-        else:
-            self.screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN)
+        self.new_entries = []
 
-        pygame.mouse.set_visible(False)
+        self.current_source = ''
+        self.current_date = datetime.date.today()
 
-        self.window_width, self.window_height = self.screen.get_size()
-        self.clock = pygame.time.Clock()
+        self.database_store = DatabaseStore(self.database_path)
+        atexit.register(self.database_store.flush)
 
-        self.font = pygame.freetype.Font(self.font_file_path, size=self.font_notify_size)
+        self.database = self.database_store.load()
 
-        self.wallpaper = pygame.image.load(self.wallpaper_path)
+        self.bookmark_db = self.database['bookmark']
+        self.newspaper_db = self.database['newspaper']
 
-        self.icon_downloading = pygame.image.load(self.icon_downloading_path)
-        self.icon_downloading_vig = pygame.image.load(self.icon_downloading_vig_path)
+        self.database_lock = threading.RLock()
 
-        self.icon_loading = pygame.image.load(self.icon_loading_path)
-        self.icon_loading_vig = pygame.image.load(self.icon_loading_vig_path)
+        self.date_index = {}
+        self.entry_sizes = {}
 
-        self.icon_empty = pygame.image.load(self.icon_empty_path)
-        self.icon_empty_vig = pygame.image.load(self.icon_empty_vig_path)
+        for entry, entry_info in self.newspaper_db.items():
 
-        self.insert_vignette = pygame.image.load(self.insert_vignette_path)
-        self.info_vignette = pygame.image.load(self.info_vignette_path)
+            self.index_entry(entry)
+            self.entry_sizes[entry] = entry_info.get('size')
 
-        self.info_text = ('', '')
-        self.info_time = 0.0
+        with open(self.credentials_path, 'r') as credentials_file:
+            self.credentials = yaml.safe_load(credentials_file)
 
-        self.insert_text = ''
-        self.insert_time = 0.0
+        self.server_host = self.credentials['archive_host']
+        self.archive_key_start = self.credentials['archive_key']
 
-        self.view_x = 0.0
-        self.view_y = 0.0
+        self.session = requests.Session()
 
-        self.scale = 1.0
+        session_adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.parallel_downloads)
+        self.session.mount('http://', session_adapter)
+        self.session.mount('https://', session_adapter)
 
-        self.rescale_mode = 1
-        self.rescale_time = 0
+        if not os.path.isdir(self.downloads_folder):
+            os.mkdir(self.downloads_folder)
 
-        self.low_res_image = None
-        self.high_res_image = None
+        if not os.path.isdir(self.archives_folder):
+            os.mkdir(self.archives_folder)
 
-        self.low_res_image_width = 0
-        self.low_res_image_height = 0
+        self.page_store = ArchivePageStore(self.archives_folder, self.archive_key_start)
 
-        self.high_res_image_width = 0
-        self.high_res_image_width = 0
+        self.server_index = self.load_index()
 
-        self.rescaled_image = None
-        self.draw_images = True
 
+    def load_index(self):
 
-    def display_info(self, info, time):
+        server_index = {'etag': None, 'modified': None, 'archives': [], 'missing': []}
 
-        self.info_text = info
-        self.info_time = time
+        if os.path.isfile(self.index_cache_path):
 
-        self.clock.tick()
+            try:
+                with open(self.index_cache_path, 'r') as index_file:
+                    server_index.update(json.load(index_file))
 
+            except (OSError, ValueError) as error:
+                print(f'Ignoring unreadable index cache: {error}')
 
-    def clear_info(self):
+        return server_index
 
-        self.info_time = 0.0
 
+    def save_index(self):
 
-    def display_insert(self, insert, time):
+        index_tmp_path = self.index_cache_path + '.tmp'
 
-        if insert == self.FIRSTPAGE:
-            self.insert_text = self.notify_first_page
+        with open(index_tmp_path, 'w') as index_file:
+            json.dump(self.server_index, index_file)
 
-        if insert == self.LASTPAGE:
-            self.insert_text = self.notify_last_page
+        os.replace(index_tmp_path, self.index_cache_path)
 
-        if insert == self.LASTDATE:
-            self.insert_text = self.notify_last_date
 
-        if insert == self.BOOKMARK:
-            self.insert_text = self.notify_bookmark
+    def save_entry(self, entry):
 
-        if insert == self.UNBOOKMARK:
-            self.insert_text = self.notify_unbookmark
+        # Serialized under the lock, retention may add to the entry meanwhile
+        self.database_lock.acquire()
+        self.database_store.put('newspaper', entry, self.newspaper_db.get(entry))
+        self.database_lock.release()
 
-        self.insert_time = time
-        self.clock.tick()
 
+    def save_bookmark(self, source):
 
-    def display_no_content(self, date):
+        self.database_lock.acquire()
+        self.database_store.put('bookmark', source, self.bookmark_db.get(source))
+        self.database_lock.release()
 
-        date_str = date.strftime('%d.%m.%Y')
-        no_content_str = self.notify_no_content.format(date_str)
 
-        self.insert_text = no_content_str
-        self.insert_time = math.inf
+    def current_entry(self):
 
+        return self.entry_name(self.current_date)
 
-    def clear_insert(self):
 
-        self.insert_time = 0.0
+    def entry_name(self, date):
 
+        date_format = date.strftime('%d-%m-%Y')
+        entry_name = f'{self.current_source}_{date_format}'
 
-    def loading_screen(self, invert):
+        return entry_name
 
-        if invert:
-            self.screen.fill(self.black)
 
-        screen_center = (0.5 * self.window_width, 0.5 * self.window_height)
-        screen_below = (0.5 * self.window_width, 0.5 * self.window_height + 250)
+    def parse_name(self, name):
 
-        text_color = self.white if invert else self.black
-        notify_surf, notify_rect = self.font.render(text=self.notify_loading, fgcolor=text_color)
+        source, date_str = name.rstrip('.zip').split('_')
+        date = datetime.datetime.strptime(date_str, '%d-%m-%Y')
 
-        notify_rect_center = notify_surf.get_rect(center=screen_center)
-        icon_rect_center = self.icon_loading.get_rect(center=screen_below)
+        return source, date.date()
 
-        if not invert:
-            bar_rect_center = self.insert_vignette.get_rect(center=screen_center)
 
-            self.screen.blit(self.insert_vignette, bar_rect_center)
-            self.screen.blit(self.icon_loading_vig, icon_rect_center)
+    def index_entry(self, entry):
 
-        self.screen.blit(notify_surf, notify_rect_center)
-        self.screen.blit(self.icon_loading, icon_rect_center)
+        entry_source, entry_date = self.parse_name(entry)
 
-        pygame.display.flip()
+        self.database_lock.acquire()
+        source_dates = self.date_index.setdefault(entry_source, [])
 
-        for event in pygame.event.get():
-            pass
+        date_pos = bisect.bisect_left(source_dates, entry_date)
+        if date_pos == len(source_dates) or source_dates[date_pos] != entry_date:
+            source_dates.insert(date_pos, entry_date)
 
+        self.database_lock.release()
 
-    def download_screen(self, perc):
 
-        self.screen.fill(self.black)
+    def unindex_entry(self, entry):
 
-        screen_center = (0.5 * self.window_width, 0.5 * self.window_height)
-        screen_newline = (0.5 * self.window_width, 0.5 * self.window_height + 40)
-        screen_below = (0.5 * self.window_width, 0.5 * self.window_height + 250)
+        entry_source, entry_date = self.parse_name(entry)
 
-        notify_surf, notify_rect = self.font.render(text=self.notify_downloading, fgcolor=self.white)
-        notify_rect_center = notify_surf.get_rect(center=screen_center)
-        self.screen.blit(notify_surf, notify_rect_center)
+        self.database_lock.acquire()
+        source_dates = self.date_index.get(entry_source, [])
 
-        percentage_str = self.notify_progress.format(perc)
-        perc_surf, perc_rect = self.font.render(percentage_str, fgcolor=self.white)
-        perc_rect_center = perc_surf.get_rect(center=screen_newline)
-        self.screen.blit(perc_surf, perc_rect_center)
+        date_pos = bisect.bisect_left(source_dates, entry_date)
+        if date_pos < len(source_dates) and source_dates[date_pos] == entry_date:
+            source_dates.pop(date_pos)
 
-        icon_rect_center = self.icon_downloading.get_rect(center=screen_below)
-        self.screen.blit(self.icon_downloading, icon_rect_center)
+        self.database_lock.release()
 
-        pygame.display.flip()
 
-        for event in pygame.event.get():
-            pass
+    def next_date(self, date):
 
+        if self.entry_navigation == self.NAVIGATE_CALENDAR:
+            return date + datetime.timedelta(days=1)
 
-    def set_draw_images(self, draw):
+        self.database_lock.acquire()
+        source_dates = self.date_index.get(self.current_source, [])
 
-        if draw != self.draw_images:
-            print(f'Image drawing {"enabled" if draw else "disabled"}')
+        date_pos = bisect.bisect_right(source_dates, date)
+        next_date = source_dates[date_pos] if date_pos < len(source_dates) else None
 
-        self.draw_images = draw
+        self.database_lock.release()
 
+        return next_date
 
-    def get_draw_images(self):
 
-        return self.draw_images
+    def prev_date(self, date):
 
+        if self.entry_navigation == self.NAVIGATE_CALENDAR:
+            return date - datetime.timedelta(days=1)
 
-    def set_images(self, low_res, high_res, dpi_ratio):
+        self.database_lock.acquire()
+        source_dates = self.date_index.get(self.current_source, [])
 
-        self.low_res_image = pygame.image.load(low_res)
-        self.high_res_image = pygame.image.load(high_res)
+        date_pos = bisect.bisect_left(source_dates, date) - 1
+        prev_date = source_dates[date_pos] if date_pos >= 0 else None
 
-        self.low_res_image_width = self.low_res_image.get_width()
-        self.low_res_image_height = self.low_res_image.get_height()
+        self.database_lock.release()
 
-        self.high_res_image_width = self.high_res_image.get_width()
-        self.high_res_image_height = self.high_res_image.get_height()
+        return prev_date
+
+
+    def update_available(self):
+
+        request_headers = {}
+
+        if self.server_index['etag']:
+            request_headers['If-None-Match'] = self.server_index['etag']
+
+        if self.server_index['modified']:
+            request_headers['If-Modified-Since'] = self.server_index['modified']
+
+        try:
+            index_response = self.session.get(self.server_host, headers=request_headers, timeout=self.request_timeout_sec)
+            index_response.raise_for_status()
+
+            if index_response.status_code != 304:
+                online_archives = index_response.json()['archives']
+
+        except (requests.RequestException, ValueError, KeyError) as error:
+            print(f'Server index unavailable, using last known index: {error}')
+
+            # Offline there is nothing to download, start with what is stored
+            self.online_archives = self.server_index['archives']
+            self.missing_archives = []
+            return
+
+        if index_response.status_code == 304:
+            print('Server index unchanged')
+            online_archives = self.server_index['archives']
+
+        known_archives = set(self.server_index['archives'])
+        listed_archives = set(online_archives)
+
+        # Only archives new to the index and the ones still missing need checking
+        candidates = [archive_name for archive_name in self.server_index['missing'] if archive_name in listed_archives]
+        candidates += [archive_name for archive_name in online_archives if not archive_name in known_archives]
+
+        self.online_archives = online_archives
+
+        self.missing_archives = []
+        for archive_name in candidates:
+
+            archive_name_base = archive_name.rstrip('.zip')
+
+            if not archive_name_base in self.newspaper_db:
+                self.missing_archives.append(archive_name)
+
+        self.server_index['etag'] = index_response.headers.get('ETag', self.server_index['etag'])
+        self.server_index['modified'] = index_response.headers.get('Last-Modified', self.server_index['modified'])
+
+        self.server_index['archives'] = self.online_archives
+        self.server_index['missing'] = self.missing_archives
+
+        self.save_index()
+
+
+    def fetch_archive(self, name, rate_limit=None):
+
+        local_archive_path = os.path.join(self.downloads_folder, name)
+
+        partial_path = local_archive_path + '.part'
+        partial_info_path = partial_path + '.json'
+
+        if os.path.isfile(local_archive_path):
+            print(f'Archive {name} already downloaded')
+
+            yield 1.0
+            return
+
+        content_size = 0
+        content_done = 0
+        content_validator = None
+
+        if os.path.isfile(partial_path) and os.path.isfile(partial_info_path):
+
+            with open(partial_info_path, 'r') as partial_info_file:
+                partial_info = json.load(partial_info_file)
+
+            content_size = partial_info['size']
+            content_validator = partial_info.get('validator')
+
+            content_done = os.path.getsize(partial_path)
+
+        request_headers = {}
+        if content_done:
+            request_headers['Range'] = f'bytes={content_done}-'
+
+            # A changed server copy is then sent whole instead of being spliced onto the old one
+            if content_validator:
+                request_headers['If-Range'] = content_validator
+
+        with self.session.get(self.server_host + name, headers=request_headers, stream=True, timeout=self.request_timeout_sec) as archive_response:
+
+            data_chunks = archive_response.iter_content(chunk_size=self.download_chunk_size)
+
+            if archive_response.status_code == 416 and content_done == content_size:
+                data_chunks = []
+
+            elif archive_response.status_code == 416:
+
+                os.remove(partial_path)
+                os.remove(partial_info_path)
+
+                raise IOError(f'Partial download of {name} does not match the server copy')
+
+            elif archive_response.status_code == 206:
+                print(f'Resuming {name} at {content_done} bytes...')
+
+                range_start, range_total = archive_response.headers['content-range'].split(' ')[1].split('/')
+                if int(range_start.split('-')[0]) != content_done:
+                    raise IOError(f'Server resumed {name} at the wrong offset')
+
+                if int(range_total) != content_size:
+
+                    os.remove(partial_path)
+                    os.remove(partial_info_path)
+
+                    raise IOError(f'Partial download of {name} does not match the server copy')
+
+            else:
+                archive_response.raise_for_status()
+                print(f'Downloading {name}...')
+
+                content_size = int(archive_response.headers.get('content-length', 0))
+                content_done = 0
+
+                # Weak entity tags are not allowed in If-Range
+                content_validator = archive_response.headers.get('etag')
+                if not content_validator or content_validator.startswith('W/'):
+                    content_validator = archive_response.headers.get('last-modified')
+
+            with open(partial_info_path, 'w') as partial_info_file:
+                json.dump({'size': content_size, 'validator': content_validator}, partial_info_file)
+
+            fetch_start = time.perf_counter()
+            content_fetched = 0
+
+            with open(partial_path, 'ab' if content_done else 'wb') as local_file:
+                for data_chunk in data_chunks:
+
+                    data_size = local_file.write(data_chunk)
+                    content_done += data_size
+
+                    content_fetched += data_size
+                    if rate_limit:
 
-        self.dpi_ratio = dpi_ratio
+                        throttle_sec = content_fetched / rate_limit - (time.perf_counter() - fetch_start)
+                        if throttle_sec > 0:
+                            time.sleep(throttle_sec)
 
-        self.initial_view()
+                    if content_size:
+                        yield content_done / content_size
 
-        self.rescale_mode = 1
-        self.rescale_time = 0
+        if content_size and content_done != content_size:
+            raise IOError(f'Download of {name} stopped at {content_done} of {content_size} bytes')
 
+        fetch_sec = time.perf_counter() - fetch_start
+        if content_fetched and fetch_sec > 0:
+            PerformanceMetrics.record('download_mbps', content_fetched / fetch_sec / 1e6)
 
-    def initial_view(self):
+        os.replace(partial_path, local_archive_path)
+        os.remove(partial_info_path)
 
-        if self.low_res_image_width * self.scale > self.window_width:
-            self.view_x = 0.5 * self.window_width / self.scale
-        else:
-            self.view_x = 0.5 * self.low_res_image_width
+        yield 1.0
 
-        if self.low_res_image_height * self.scale > self.window_height:
-            self.view_y = 0.5 * self.window_height / self.scale
-        else:
-            self.view_y = 0.5 * self.low_res_image_height
 
+    def store_archive(self, name):
 
-    def set_center(self, px, py):
+        local_archive_path = os.path.join(self.downloads_folder, name)
+        archive_name_base = name.rstrip('.zip')
 
-        self.view_x = px
-        self.view_y = py
+        start_time = time.perf_counter()
 
-        if px < 0:
-            self.view_x = 0.0
-        if py < 0:
-            self.view_y = 0.0
+        # Only info.json is decrypted here, pages are read on demand
+        try:
+            with self.page_store.open_archive(local_archive_path, archive_name_base) as archive_file:
+                print(f'Storing {name}...')
 
-        if px > self.low_res_image_width:
-            self.view_x = self.low_res_image_width
-        if py > self.low_res_image_height:
-            self.view_y = self.low_res_image_height
+                newspaper_entry = json.loads(archive_file.read('info.json'))
 
+        except (pyzipper.BadZipFile, RuntimeError, OSError, ValueError, KeyError):
 
-    def move_center(self, dx, dy):
+            # A broken download would otherwise be taken as already downloaded on every sync
+            os.remove(local_archive_path)
+            raise
 
-        new_view_x = self.view_x + dx
-        new_view_y = self.view_y + dy
+        os.replace(local_archive_path, self.page_store.archive_path(archive_name_base))
+        yield 1.0
 
-        self.set_center(new_view_x, new_view_y)
+        newspaper_entry['page'] = 1
+        newspaper_entry['size'] = os.path.getsize(self.page_store.archive_path(archive_name_base))
 
+        PerformanceMetrics.record('store_ms', 1000 * (time.perf_counter() - start_time))
 
-    def set_scale(self, scale):
+        return newspaper_entry
 
-        if scale < self.min_scale:
-            scale = self.min_scale
-        if scale > self.max_scale:
-            scale = self.max_scale
 
-        if scale != self.scale:
-            self.scale = scale
+    def publish_entry(self, name, newspaper_entry):
 
-            RescaleWorker.abort()
+        archive_name_base = name.rstrip('.zip')
 
-            self.rescale_mode = 1
-            self.rescale_time = time.time()
+        self.database_lock.acquire()
 
+        self.newspaper_db[archive_name_base] = newspaper_entry
+        self.entry_sizes[archive_name_base] = newspaper_entry.get('size')
 
-    def change_scale(self, factor):
+        self.index_entry(archive_name_base)
+        self.new_entries.append(archive_name_base)
 
-        self.set_scale(self.scale * factor)
+        self.database_lock.release()
 
+        self.save_entry(archive_name_base)
 
-    def draw(self):
 
-        self.clock.tick()
-        dt = self.clock.get_time()
+    def pop_new_entries(self):
 
-        # Draw background
-        self.screen.blit(self.wallpaper, dest=(0, 0))
+        self.database_lock.acquire()
 
-        if self.draw_images:
+        new_entries = self.new_entries
+        self.new_entries = []
 
-            # Rescale image
+        self.database_lock.release()
 
-            if self.rescale_mode == 1:
+        return new_entries
 
-                current_time = time.time()
-                if (current_time - self.rescale_time) > self.rescale_wait_sec:
 
-                    self.rescale_mode = 2
-                    RescaleWorker(self)
+    def download_archive(self, name):
 
-            # Draw newspaper
+        perc_reported = 0
 
-            if self.rescale_mode == 0:
+        for fraction in self.fetch_archive(name):
 
-                location_top = 0.5 * self.window_width - self.view_x * self.scale
-                location_left = 0.5 * self.window_height - self.view_y * self.scale
+            percentage = math.floor(50 * fraction)
+            if percentage > perc_reported:
+                perc_reported = percentage
+                yield percentage
 
-                self.screen.blit(self.rescaled_image, dest=(location_top, location_left))
+        store_gen = self.store_archive(name)
 
-            else:
+        try:
+            while True:
 
-                viewport_width = self.window_width / self.scale
-                viewport_height = self.window_height / self.scale
+                percentage = 50 + math.floor(50 * next(store_gen))
+                if percentage > perc_reported:
+                    perc_reported = percentage
+                    yield percentage
 
-                viewport_top = self.view_x - 0.5 * viewport_width
-                viewport_left = self.view_y - 0.5 * viewport_height
+        except StopIteration as store_stop:
+            self.publish_entry(name, store_stop.value)
 
-                viewport_surf = pygame.Surface((viewport_width, viewport_height), flags=pygame.SRCALPHA)
-                viewport = (viewport_top, viewport_left, viewport_width, viewport_height)
 
-                viewport_surf.fill(self.transparency)
-                viewport_surf.blit(self.low_res_image, dest=(0, 0), area=viewport)
+    def run_stage(self, stage_gen, progress, stage, updates):
 
-                scaled_surf = pygame.transform.scale(viewport_surf, (self.window_width, self.window_height))
-                self.screen.blit(scaled_surf, (0, 0))
+        try:
+            while True:
+                progress[stage] = next(stage_gen)
+                updates.put(None)
 
+        except StopIteration as stage_stop:
+            return stage_stop.value
 
-        # Draw info text
 
-        if self.info_time > 0:
-            self.info_time = (self.info_time - dt) if self.info_time > dt else 0.0
+    def ingest_archive(self, name, store_pool, progress, updates, rate_limit):
 
-            screen_top_left = (15, 12)
-            screen_top_right = (self.window_width - 15, 12)
-            overlay_alpha = 255 * (1.0 - math.exp(-self.overlay_fade_exp * self.info_time))
+        self.run_stage(self.fetch_archive(name, rate_limit), progress, 0, updates)
 
-            info_text_left, info_text_right = self.info_text
-            bar_rect_top_left = self.info_vignette.get_rect(topleft=(0, 0))
+        # Storing runs on its own worker so the next download can start right away
+        return store_pool.submit(self.run_stage, self.store_archive(name), progress, 1, updates)
 
-            text_left_surf, text_left_rect = self.font.render(text=info_text_left, fgcolor=self.black)
-            text_left_rect_top_left = text_left_surf.get_rect(topleft=screen_top_left)
 
-            text_right_surf, text_right_rect = self.font.render(text=info_text_right, fgcolor=self.black)
-            text_right_rect_top_right = text_right_surf.get_rect(topright=screen_top_right)
+    def download_recent(self, background=False):
 
-            transparent_surf = pygame.Surface((self.window_width, self.window_height), flags=pygame.SRCALPHA)
-            transparent_surf.fill(self.transparency)
+        today = datetime.date.today()
 
-            transparent_surf.blit(self.info_vignette, bar_rect_top_left)
-            transparent_surf.blit(text_left_surf, text_left_rect_top_left)
-            transparent_surf.blit(text_right_surf, text_right_rect_top_right)
+        for_download = []
+        for missing_archive in self.missing_archives:
 
-            transparent_surf.set_alpha(overlay_alpha)
-            self.screen.blit(transparent_surf, (0, 0))
+            source, archive_date = self.parse_name(missing_archive)
+            archive_age = today - archive_date
 
-        # Draw text insert
+            if not archive_age.days > self.history_days:
+                for_download.append(missing_archive)
 
-        if self.insert_time > 0:
-            self.insert_time = (self.insert_time - dt) if self.insert_time > dt else 0.0
+        downloads_count = len(for_download)
+        if not downloads_count:
+            return
 
-            screen_center = (0.5 * self.window_width, 0.5 * self.window_height)
-            overlay_alpha = 255 * (1.0 - math.exp(-self.overlay_fade_exp * self.insert_time))
+        print(f'Downloading {downloads_count} archives, {self.parallel_downloads} at a time')
 
-            bar_rect_center = self.insert_vignette.get_rect(center=screen_center)
+        rate_limit = self.sync_rate_limit if background else None
+        pool_initializer = self.lower_priority if background else None
 
-            text_surf, text_rect = self.font.render(text=self.insert_text, fgcolor=self.black)
-            text_rect_center = text_surf.get_rect(center=screen_center)
+        download_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.parallel_downloads, initializer=pool_initializer)
+        store_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, initializer=pool_initializer)
 
-            transparent_surf = pygame.Surface((self.window_width, self.window_height), flags=pygame.SRCALPHA)
-            transparent_surf.fill(self.transparency)
+        updates = queue.Queue()
+        progress = {}
+        ingest_futures = {}
 
-            transparent_surf.blit(self.insert_vignette, bar_rect_center)
-            transparent_surf.blit(text_surf, text_rect_center)
+        for archive_name in for_download:
 
-            transparent_surf.set_alpha(overlay_alpha)
-            self.screen.blit(transparent_surf, (0, 0))
+            progress[archive_name] = [0.0, 0.0]
+            ingest_futures[archive_name] = download_pool.submit(self.ingest_archive, archive_name, store_pool, progress[archive_name], updates, rate_limit)
 
-        # Done drawing
-        pygame.display.flip()
+        perc_reported = 0
+        store_futures = {}
 
-        # Handle events
-        for event in pygame.event.get():
-            pass
+        while ingest_futures or store_futures:
 
-        return dt
+            try:
+                updates.get(timeout=0.1)
+            except queue.Empty:
+                pass
 
+            for archive_name, ingest_future in list(ingest_futures.items()):
 
+                if not ingest_future.done():
+                    continue
 
-class ArchiveManager:
+                del ingest_futures[archive_name]
 
-    history_days = 1
+                try:
+                    store_futures[archive_name] = ingest_future.result()
+                except (requests.RequestException, OSError) as error:
+                    print(f'Downloading {archive_name} failed: {error}')
 
-    database_path = 'database.json'
-    credentials_path = 'credentials.yaml'
+            for archive_name, store_future in list(store_futures.items()):
 
-    downloads_folder = 'downloads'
-    renderings_folder = 'renderings'
+                if not store_future.done():
+                    continue
 
-    entry_info_template = '{} vom {}'
-    page_info_template = 'Seite {}'
+                del store_futures[archive_name]
 
+                try:
+                    self.publish_entry(archive_name, store_future.result())
+                except (pyzipper.BadZipFile, RuntimeError, OSError, ValueError, KeyError) as error:
+                    print(f'Storing {archive_name} failed: {error}')
 
-    def __init__(self):
+            archives_progress = sum(50 * fetched + 50 * stored for fetched, stored in progress.values())
 
-        self.online_archives = []
-        self.missing_archives = []
+            total_percentage = math.floor(archives_progress / downloads_count)
+            if total_percentage > perc_reported:
+                perc_reported = total_percentage
+                yield total_percentage
 
-        self.current_source = ''
-        self.current_date = datetime.date.today()
+        download_pool.shutdown()
+        store_pool.shutdown()
 
-        if not os.path.isfile(self.database_path):
-            empty_database = {'bookmark': {}, 'newspaper': {}}
 
-            with open(self.database_path, 'w') as database_file:
-                json.dump(empty_database, database_file)
+    def start_sync(self):
 
-        with open(self.database_path, 'r') as database_file:
-            self.database = json.load(database_file)
+        self.sync_th = threading.Thread(target=self.sync_worker, daemon=True)
+        self.sync_th.start()
 
-        self.bookmark_db = self.database['bookmark']
-        self.newspaper_db = self.database['newspaper']
 
-        with open(self.credentials_path, 'r') as credentials_file:
-            self.credentials = yaml.safe_load(credentials_file)
+    def lower_priority(self):
 
-        self.server_host = self.credentials['archive_host']
-        self.archive_key_start = self.credentials['archive_key']
+        # Niceness is per thread on Linux, the reader keeps its own priority
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.sync_niceness)
+        except (AttributeError, OSError) as error:
+            print(f'Could not lower sync priority: {error}')
 
-        if not os.path.isdir(self.downloads_folder):
-            os.mkdir(self.downloads_folder)
 
-        if not os.path.isdir(self.renderings_folder):
-            os.mkdir(self.renderings_folder)
+    def sync_worker(self):
 
+        self.lower_priority()
 
-    def save_database(self):
+        while True:
+            time.sleep(self.sync_interval_sec)
 
-        with open(self.database_path, 'w') as database_file:
+            try:
+                self.update_available()
 
-            print('Writing to database')
-            json.dump(self.database, database_file)
+                for progress_perc in self.download_recent(background=True):
+                    pass
 
+            # Anything escaping here would end the sync for the rest of the session
+            except Exception as error:
+                print(f'Background sync failed: {error!r}')
 
-    def current_entry(self):
 
-        date_format = self.current_date.strftime('%d-%m-%Y')
-        current_entry = f'{self.current_source}_{date_format}'
+    def start_retention(self):
 
-        return current_entry
+        self.retention_th = threading.Thread(target=self.retention_worker, daemon=True)
+        self.retention_th.start()
 
 
-    def parse_name(self, name):
+    def retention_worker(self):
 
-        source, date_str = name.rstrip('.zip').split('_')
-        date = datetime.datetime.strptime(date_str, '%d-%m-%Y')
+        while True:
 
-        return source, date.date()
+            self.delete_older(self.retention_days)
+            time.sleep(self.retention_interval_sec)
 
 
-    def update_available(self):
+    def entry_protected(self, entry):
 
-        server_index = requests.get(self.server_host).json()
-        self.online_archives = server_index['archives']
+        return entry == self.current_entry() or entry in self.bookmark_db.values()
 
-        self.missing_archives = []
-        for archive_name in self.online_archives:
 
-            archive_name_base = archive_name.rstrip('.zip')
+    def measure_entry(self, entry):
 
-            if not archive_name_base in self.newspaper_db:
-                self.missing_archives.append(archive_name)
+        archive_path = self.page_store.archive_path(entry)
+        if os.path.isfile(archive_path):
+            return os.path.getsize(archive_path)
 
+        entry_size = 0
 
-    def download_archive(self, name):
+        unpack_folder_path = os.path.join(self.renderings_folder, entry)
+        if os.path.isdir(unpack_folder_path):
 
-        local_archive_path = os.path.join(self.downloads_folder, name)
-        archive_name_base = name.rstrip('.zip')
+            for dir_entry in os.scandir(unpack_folder_path):
+                if dir_entry.is_file():
+                    entry_size += dir_entry.stat().st_size
 
-        perc_reported = 0
+        return entry_size
 
-        with requests.get(self.server_host + name, stream=True) as archive_response:
-            print('Downloading...')
 
-            content_size = int(archive_response.headers.get('content-length', 0))
-            content_done = 0
+    def retention_candidate(self, days, today):
 
-            with open(local_archive_path, 'wb') as local_file:
-                for data_chunk in archive_response.iter_content(chunk_size=1024):
+        self.database_lock.acquire()
+        entry_sizes = list(self.entry_sizes.items())
+        self.database_lock.release()
 
-                    data_size = local_file.write(data_chunk)
+        # Entries from before the ledger existed are measured one per step
+        for entry, entry_size in entry_sizes:
+            if entry_size is None:
+                return entry, False
 
-                    content_done += data_size
-                    percentage = math.floor(50 * content_done / content_size)
+        total_size = sum(entry_size for entry, entry_size in entry_sizes)
+        dated_entries = sorted((self.parse_name(entry)[1], entry) for entry, entry_size in entry_sizes)
 
-                    if percentage > perc_reported:
-                        perc_reported = percentage
-                        yield percentage
+        # The current entry and bookmarks are changed by the UI thread under the same lock
+        self.database_lock.acquire()
 
-        unpack_folder_path = os.path.join(self.renderings_folder, archive_name_base)
-        os.makedirs(unpack_folder_path)
+        candidate = None
+        for entry_date, entry in dated_entries:
 
-        archive_key = (self.archive_key_start + archive_name_base).encode()
-        archive_pw = hashlib.md5(archive_key).hexdigest().encode()
+            if self.entry_protected(entry):
+                continue
 
-        with pyzipper.AESZipFile(local_archive_path, 'r') as archive_file:
-            print('Extracting...')
+            if (today - entry_date).days > days or total_size > self.retention_budget:
+                candidate = entry
 
-            archive_file.setpassword(archive_pw)
+            break
 
-            all_member_paths = archive_file.infolist()
-            member_count = len(all_member_paths)
+        self.database_lock.release()
 
-            for i, member_path in enumerate(all_member_paths):
+        return candidate, candidate is not None
 
-                archive_file.extract(member_path, unpack_folder_path)
-                percentage = 50 + math.floor(50 * (i+1) / member_count)
 
-                if percentage > perc_reported:
-                    perc_reported = percentage
-                    yield percentage
+    def delete_older(self, days):
 
-        os.remove(local_archive_path)
+        today = datetime.date.today()
 
-        info_file_path = os.path.join(unpack_folder_path, 'info.json')
-        with open(info_file_path, 'r') as info_file:
-            newspaper_entry = json.load(info_file)
+        while True:
 
-        newspaper_entry['page'] = 1
-        self.newspaper_db[archive_name_base] = newspaper_entry
-        self.save_database()
+            entry, evict = self.retention_candidate(days, today)
+            if entry is None:
+                break
 
+            if evict:
+                self.delete_entry(entry)
 
-    def download_recent(self):
+            else:
+                entry_size = self.measure_entry(entry)
 
-        today = datetime.date.today()
+                self.database_lock.acquire()
+                if entry in self.newspaper_db:
+                    self.newspaper_db[entry]['size'] = entry_size
+                    self.entry_sizes[entry] = entry_size
+                self.database_lock.release()
 
-        for_download = []
-        for missing_archive in self.missing_archives:
+                self.save_entry(entry)
 
-            source, archive_date = self.parse_name(missing_archive)
-            archive_age = today - archive_date
+            time.sleep(self.retention_step_sec)
 
-            if not archive_age.days > self.history_days:
-                for_download.append(missing_archive)
 
-        downloads_count = len(for_download)
+    def delete_entry(self, entry):
 
-        for i, archive_name in enumerate(for_download):
-            print(f'Downloading {i+1}/{downloads_count}: {archive_name}')
+        self.database_lock.acquire()
 
-            download_gen = self.download_archive(archive_name)
+        if entry not in self.newspaper_db or self.entry_protected(entry):
+            self.database_lock.release()
+            return
 
-            for percentage in download_gen:
+        self.newspaper_db.pop(entry)
+        self.entry_sizes.pop(entry, None)
 
-                total_percentage = int(percentage / downloads_count + i * 100 / downloads_count)
-                yield total_percentage
+        self.unindex_entry(entry)
+        self.database_lock.release()
 
+        self.save_entry(entry)
+        self.page_store.close_entry(entry)
 
-    def delete_older(self, days):
+        archive_path = self.page_store.archive_path(entry)
+        if os.path.isfile(archive_path):
+            os.remove(archive_path)
 
-        today = datetime.date.today()
-        # TODO
+        unpack_folder_path = os.path.join(self.renderings_folder, entry)
+        if os.path.isdir(unpack_folder_path):
+            shutil.rmtree(unpack_folder_path)
+
+        print(f'Deleted entry {entry}')
 
 
     def create_bookmark(self):
@@ -651,15 +3026,21 @@ class ArchiveManager:
         current_entry = self.current_entry()
         print(f'Bookmark created: {current_entry}')
 
+        self.database_lock.acquire()
         self.bookmark_db[self.current_source] = current_entry
-        self.save_database()
+        self.database_lock.release()
+
+        self.save_bookmark(self.current_source)
 
 
     def remove_bookmark(self):
 
         print(f'Bookmark removed')
+        self.database_lock.acquire()
         self.bookmark_db.pop(self.current_source, None)
-        self.save_database()
+        self.database_lock.release()
+
+        self.save_bookmark(self.current_source)
 
 
     def bookmark_set(self):
@@ -673,6 +3054,9 @@ class ArchiveManager:
         if not source:
             return
 
+        # Source and date change together so retention never sees a half switched entry
+        self.database_lock.acquire()
+
         self.current_source = source
         print(f'Now using {source} as source')
 
@@ -686,24 +3070,21 @@ class ArchiveManager:
         else:
             self.newest_entry()
 
+        self.database_lock.release()
 
-    def newest_entry(self):
-
-        newest_date = datetime.date.min
-        newest_entry = ''
 
-        for entry in self.newspaper_db:
-
-            entry_source, entry_data = self.parse_name(entry)
-            if entry_source == self.current_source and entry_data > newest_date:
+    def newest_entry(self):
 
-                newest_date = entry_data
-                newest_entry = entry
+        source_dates = self.date_index.get(self.current_source)
 
-        if not newest_entry:
+        if source_dates:
+            newest_date = source_dates[-1]
+        else:
             newest_date = datetime.date.today()
 
+        self.database_lock.acquire()
         self.current_date = newest_date
+        self.database_lock.release()
 
         date_format = newest_date.strftime('%d-%m-%Y')
         print(f'Applying {date_format} as newest date')
@@ -711,14 +3092,26 @@ class ArchiveManager:
 
     def next_entry(self):
 
-        self.current_date += datetime.timedelta(days=1)
+        next_date = self.next_date(self.current_date)
+
+        if next_date is None:
+
+            print(f'Newest edition reached')
+            return False
+
+        if next_date > datetime.date.today():
 
-        if self.current_date > datetime.date.today():
+            self.database_lock.acquire()
             self.current_date = datetime.date.today()
+            self.database_lock.release()
 
             print(f'Date of today reached')
             return False
 
+        self.database_lock.acquire()
+        self.current_date = next_date
+        self.database_lock.release()
+
         date_format = self.current_date.strftime('%d-%m-%Y')
         print(f'Switched to date {date_format}')
 
@@ -727,7 +3120,16 @@ class ArchiveManager:
 
     def prev_entry(self):
 
-        self.current_date -= datetime.timedelta(days=1)
+        prev_date = self.prev_date(self.current_date)
+
+        if prev_date is None:
+
+            print(f'Oldest edition reached')
+            return
+
+        self.database_lock.acquire()
+        self.current_date = prev_date
+        self.database_lock.release()
 
         date_format = self.current_date.strftime('%d-%m-%Y')
         print(f'Switched to date {date_format}')
@@ -743,8 +3145,11 @@ class ArchiveManager:
 
         entry_info = self.newspaper_db[current_entry]
 
+        self.database_lock.acquire()
         entry_info['page'] = 1
-        self.save_database()
+        self.database_lock.release()
+
+        self.save_entry(current_entry)
 
         print(f'Turned to first page')
 
@@ -760,8 +3165,11 @@ class ArchiveManager:
         entry_info = self.newspaper_db[current_entry]
         page_count = entry_info['page_count']
 
+        self.database_lock.acquire()
         entry_info['page'] = page_count
-        self.save_database()
+        self.database_lock.release()
+
+        self.save_entry(current_entry)
 
         print(f'Turned to last page')
 
@@ -786,8 +3194,11 @@ class ArchiveManager:
             print(f'Last page reached')
             return False
 
+        self.database_lock.acquire()
         entry_info['page'] = page_nr
-        self.save_database()
+        self.database_lock.release()
+
+        self.save_entry(current_entry)
 
         print(f'Turned to page {page_nr}')
         return True
@@ -812,8 +3223,11 @@ class ArchiveManager:
             print(f'First page reached')
             return False
 
+        self.database_lock.acquire()
         entry_info['page'] = page_nr
-        self.save_database()
+        self.database_lock.release()
+
+        self.save_entry(current_entry)
 
         print(f'Turned to page {page_nr}')
         return True
@@ -859,18 +3273,84 @@ class ArchiveManager:
         current_entry = self.current_entry()
         entry_info = self.newspaper_db[current_entry]
 
-        page_nr = entry_info['page']
+        return self.get_page_images(current_entry, entry_info['page'])
+
+
+    def get_opened_key(self):
+
+        current_entry = self.current_entry()
+        entry_info = self.newspaper_db[current_entry]
+
+        return current_entry, entry_info['page']
+
+
+    def get_page_images(self, entry, page_nr):
+
         page_nr_filled = str(page_nr).zfill(2)
 
-        image_path_low = os.path.join(self.renderings_folder, current_entry, f'{page_nr_filled}_lo.png')
-        image_path_high = os.path.join(self.renderings_folder, current_entry, f'{page_nr_filled}_hi.png')
+        if self.page_store.has_entry(entry):
+
+            image_low = self.page_store.member(entry, f'{page_nr_filled}_lo.png')
+            image_high = self.page_store.member(entry, f'{page_nr_filled}_hi.png')
+
+            return image_low, image_high
+
+        # Entries downloaded before archives were kept are still read from renderings
+        image_path_low = os.path.join(self.renderings_folder, entry, f'{page_nr_filled}_lo.png')
+        image_path_high = os.path.join(self.renderings_folder, entry, f'{page_nr_filled}_hi.png')
 
         images_exist = os.path.isfile(image_path_low) and os.path.isfile(image_path_high)
-        assert images_exist, f'Images {image_path_low} and/or {image_path_high} for {current_entry} not found'
+        assert images_exist, f'Images {image_path_low} and/or {image_path_high} for {entry} not found'
 
         return image_path_low, image_path_high
 
 
+    def get_entry_pages(self, entry):
+
+        entry_info = self.newspaper_db[entry]
+
+        entry_pages = []
+        for page_nr in range(1, entry_info['page_count'] + 1):
+            entry_pages.append(((entry, page_nr), self.get_page_images(entry, page_nr)))
+
+        return entry_pages
+
+
+    def get_neighbour_pages(self):
+
+        neighbour_pages = []
+
+        current_entry = self.current_entry()
+        if current_entry in self.newspaper_db:
+
+            entry_info = self.newspaper_db[current_entry]
+            page_nr = entry_info['page']
+
+            if page_nr < entry_info['page_count']:
+                neighbour_pages.append((current_entry, page_nr + 1))
+            if page_nr > 1:
+                neighbour_pages.append((current_entry, page_nr - 1))
+
+        for neighbour_date in (self.prev_date(self.current_date), self.next_date(self.current_date)):
+
+            if neighbour_date is None:
+                continue
+
+            neighbour_entry = self.entry_name(neighbour_date)
+            if neighbour_entry in self.newspaper_db:
+                neighbour_pages.append((neighbour_entry, self.newspaper_db[neighbour_entry]['page']))
+
+        prefetch_requests = []
+        for entry, page_nr in neighbour_pages:
+
+            try:
+                prefetch_requests.append(((entry, page_nr), self.get_page_images(entry, page_nr)))
+            except AssertionError as error:
+                print(error)
+
+        return prefetch_requests
+
+
     def get_dpi_ratio(self):
 
         current_entry = self.current_entry()
@@ -891,10 +3371,17 @@ class InputManager:
 
     sensors_dpdt = 0.1
 
+    sample_rate_hz = 200
+    button_thres = 0.5
+    button_debounce_samples = 4
+    control_filter_sec = 0.04
+    control_hysteresis = 0.004
 
     keyboard_dpdt = 0.1
     keyboard_dsdt = 0.001
 
+    control_dt_max = 50
+
     long_press_thres = 1000
 
     gpio_pins = {'shutdown': 0, 'led_pwm': 11, 'source_0': 36, 'source_1': 38, 'source_2': 40}
@@ -920,11 +3407,11 @@ class InputManager:
         self.viewer = viewer
         self.events = []
 
-        self.next_entry_pressed = 0.0
-        self.prev_entry_pressed = 0.0
+        self.next_entry_pressed = None
+        self.prev_entry_pressed = None
 
-        self.next_page_pressed = 0.0
-        self.prev_page_pressed = 0.0
+        self.next_page_pressed = None
+        self.prev_page_pressed = None
 
         self.next_entry_locked = False
         self.prev_entry_locked = False
@@ -932,36 +3419,48 @@ class InputManager:
         self.next_page_locked = False
         self.prev_page_locked = False
 
+        self.button_names = ('next_entry', 'prev_entry', 'next_page', 'prev_page')
+        self.control_names = ('joystick_x', 'joystick_y', 'magnification')
+
+        # Written whole by the sampler, so the main loop reads it without locking
+        self.sensor_snapshot = ((0,) * len(self.button_names), (0.5, 0.5, 0.0))
+
+        self.controls_time = None
+        self.controls_marked = None
+
         if self.allow_sensors:
 
             import spidev
             import mraa
 
-            self.spi = spidev.Spidev()
+            self.spi = spidev.SpiDev()
+            self.spi.open(*self.spi_bus_device)
 
             self.spi.max_speed_hz = 1000000
-            self.spi.open(*spi_bus_device)
 
             # TODO
-            #self.gpio_shutdown = mraa.Gpio(gpio_pins['shutdown'])
+            #self.gpio_shutdown = mraa.Gpio(self.gpio_pins['shutdown'])
 
-            self.pwm_led_green = mraa.Pwm(gpio_pins['led_pwm'])
+            self.pwm_led_green = mraa.Pwm(self.gpio_pins['led_pwm'])
             self.pwm_led_green.enable(True)
 
-            self.gpio_source_0 = mraa.Gpio(gpio_pins['source_0'])
+            self.gpio_source_0 = mraa.Gpio(self.gpio_pins['source_0'])
             self.gpio_source_0.dir(mraa.DIR_IN)
 
-            self.gpio_source_1 = mraa.Gpio(gpio_pins['source_1'])
+            self.gpio_source_1 = mraa.Gpio(self.gpio_pins['source_1'])
             self.gpio_source_1.dir(mraa.DIR_IN)
 
-            self.gpio_source_2 = mraa.Gpio(gpio_pins['source_2'])
+            self.gpio_source_2 = mraa.Gpio(self.gpio_pins['source_2'])
             self.gpio_source_2.dir(mraa.DIR_IN)
 
+            self.sampler_th = threading.Thread(target=self.sampler, daemon=True)
+            self.sampler_th.start()
+
 
     def get_source(self):
 
         if self.allow_sensors:
-            source_selected = (gpio_source_0.read(), gpio_source_1.read(), gpio_source_2.read())
+            source_selected = (self.gpio_source_0.read(), self.gpio_source_1.read(), self.gpio_source_2.read())
         else:
             source_selected = (1, 0, 0)
 
@@ -975,15 +3474,81 @@ class InputManager:
         return None
 
 
-    def get_channel(self, channel):
+    def read_channels(self, channels):
 
-        if not self.allow_sensors:
-            return 0.0
+        # The MCP3008 needs chip select raised between conversions, so the burst is one transfer per channel
+        requests = [[1, (8 + channel) << 4, 0] for channel in channels]
+        responses = [self.spi.xfer2(request) for request in requests]
+
+        return [(((adc[1] & 3) << 8) + adc[2]) / 1023.0 for adc in responses]
+
+
+    def sampler(self):
+
+        channels = [self.analog_channels[name] for name in self.button_names + self.control_names]
+        button_count = len(self.button_names)
+
+        sample_interval = 1.0 / self.sample_rate_hz
+        filter_alpha = 1.0 - math.exp(-sample_interval / self.control_filter_sec)
+
+        buttons_stable = [0] * button_count
+        buttons_agreeing = [0] * button_count
+
+        controls_filtered = None
+        controls_published = None
+
+        next_sample = time.perf_counter()
+
+        while True:
+
+            channel_values = self.read_channels(channels)
+
+            button_values = channel_values[:button_count]
+            control_values = channel_values[button_count:]
+
+            # A button only changes state after enough consecutive samples agree
+            for button_idx, button_value in enumerate(button_values):
+
+                button_state = int(button_value > self.button_thres)
+
+                if button_state == buttons_stable[button_idx]:
+                    buttons_agreeing[button_idx] = 0
+                    continue
+
+                buttons_agreeing[button_idx] += 1
+                if buttons_agreeing[button_idx] >= self.button_debounce_samples:
+
+                    buttons_stable[button_idx] = button_state
+                    buttons_agreeing[button_idx] = 0
+
+            if controls_filtered is None:
+                controls_filtered = list(control_values)
+                controls_published = list(control_values)
+
+            for control_idx, control_value in enumerate(control_values):
 
-        adc = self.spi.xfer2([1, (8 + channel) << 4, 0])
-        value = ((adc[1] & 3) << 8) + adc[2]
+                controls_filtered[control_idx] += filter_alpha * (control_value - controls_filtered[control_idx])
 
-        return value / 1023.0
+                # Small wobble would otherwise restart the rescale on every frame
+                if abs(controls_filtered[control_idx] - controls_published[control_idx]) > self.control_hysteresis:
+                    controls_published[control_idx] = controls_filtered[control_idx]
+
+                    # Input latency of pan and zoom is measured from this sample
+                    self.controls_time = next_sample
+
+            sensor_snapshot = (tuple(buttons_stable), tuple(controls_published))
+
+            if sensor_snapshot != self.sensor_snapshot:
+                self.sensor_snapshot = sensor_snapshot
+                self.viewer.wake()
+
+            next_sample += sample_interval
+            sleep_sec = next_sample - time.perf_counter()
+
+            if sleep_sec > 0:
+                time.sleep(sleep_sec)
+            else:
+                next_sample = time.perf_counter()
 
 
     def button_input(self, dt):
@@ -991,11 +3556,11 @@ class InputManager:
         buttons_pressed = {'next_entry': 0, 'prev_entry': 0, 'next_page': 0, 'prev_page': 0}
 
         if self.allow_sensors:
-            for button in buttons_pressed:
 
-                button_channel = self.analog_channels[button]
-                channel_value = self.get_channel(button_channel)
-                buttons_pressed[button] += channel_value > 0.5
+            buttons_sampled, controls_sampled = self.sensor_snapshot
+
+            for button, button_state in zip(self.button_names, buttons_sampled):
+                buttons_pressed[button] += button_state
 
         if self.allow_keyboard:
             keys_pressed = pygame.key.get_pressed()
@@ -1005,77 +3570,87 @@ class InputManager:
                 button_key = self.keyboard_assign[button]
                 buttons_pressed[button] += keys_pressed[button_key]
 
+        # Presses are timed against the clock, frame intervals vary with the frame rate governor
+        press_time = 1000 * time.perf_counter()
+        self.viewer.input_active = any(buttons_pressed.values())
+
         if buttons_pressed['next_entry']:
 
-            self.next_entry_pressed += dt
-            if self.next_entry_pressed > self.long_press_thres and not self.next_entry_locked:
+            if self.next_entry_pressed is None:
+                self.next_entry_pressed = press_time
+
+            if press_time - self.next_entry_pressed > self.long_press_thres and not self.next_entry_locked:
                 self.events.append(self.NEXTENTRYLONG)
                 self.next_entry_locked = True
 
         else:
 
-            if self.next_entry_pressed > 0 and not self.next_entry_locked:
+            if self.next_entry_pressed is not None and not self.next_entry_locked:
                 self.events.append(self.NEXTENTRY)
-            self.next_entry_pressed = 0.0
+            self.next_entry_pressed = None
             self.next_entry_locked = False
 
         if buttons_pressed['prev_entry']:
 
-            self.prev_entry_pressed += dt
-            if self.prev_entry_pressed > self.long_press_thres and not self.prev_entry_locked:
+            if self.prev_entry_pressed is None:
+                self.prev_entry_pressed = press_time
+
+            if press_time - self.prev_entry_pressed > self.long_press_thres and not self.prev_entry_locked:
                 self.events.append(self.PREVENTRYLONG)
                 self.prev_entry_locked = True
 
         else:
 
-            if self.prev_entry_pressed > 0 and not self.prev_entry_locked:
+            if self.prev_entry_pressed is not None and not self.prev_entry_locked:
                 self.events.append(self.PREVENTRY)
-            self.prev_entry_pressed = 0.0
+            self.prev_entry_pressed = None
             self.prev_entry_locked = False
 
         if buttons_pressed['next_page']:
 
-            self.next_page_pressed += dt
-            if self.next_page_pressed > self.long_press_thres and not self.next_page_locked:
+            if self.next_page_pressed is None:
+                self.next_page_pressed = press_time
+
+            if press_time - self.next_page_pressed > self.long_press_thres and not self.next_page_locked:
                 self.events.append(self.NEXTPAGELONG)
                 self.next_page_locked = True
 
         else:
 
-            if self.next_page_pressed > 0 and not self.next_page_locked:
+            if self.next_page_pressed is not None and not self.next_page_locked:
                 self.events.append(self.NEXTPAGE)
-            self.next_page_pressed = 0.0
+            self.next_page_pressed = None
             self.next_page_locked = False
 
         if buttons_pressed['prev_page']:
 
-            self.prev_page_pressed += dt
-            if self.prev_page_pressed > self.long_press_thres and not self.prev_page_locked:
+            if self.prev_page_pressed is None:
+                self.prev_page_pressed = press_time
+
+            if press_time - self.prev_page_pressed > self.long_press_thres and not self.prev_page_locked:
                 self.events.append(self.PREVPAGELONG)
                 self.prev_page_locked = True
 
         else:
 
-            if self.prev_page_pressed > 0 and not self.prev_page_locked:
+            if self.prev_page_pressed is not None and not self.prev_page_locked:
                 self.events.append(self.PREVPAGE)
-            self.prev_page_pressed = 0.0
+            self.prev_page_pressed = None
             self.prev_page_locked = False
 
 
     def control_input(self, dt):
 
+        # The first frame after an idle wait would otherwise jump
+        dt = min(dt, self.control_dt_max)
+
         translate_delta_x = 0.0
         translate_delta_y = 0.0
 
         if self.allow_sensors:
 
-            controls_values = {'joystick_x': 0.0, 'joystick_y': 0.0, 'magnification': 0.0}
-
-            for control in controls_values:
-
-                control_channel = self.analog_channels[control]
-                channel_value = self.get_channel(control_channel)
-                controls_values[button] += channel_value
+            buttons_sampled, controls_sampled = self.sensor_snapshot
+            controls_values = dict(zip(self.control_names, controls_sampled))
 
             sensors_translate = self.sensors_dpdt * dt
 
@@ -1085,6 +3660,10 @@ class InputManager:
             control_scale = controls_values['magnification'] * 9.0 + 1.0
             self.viewer.set_scale(control_scale)
 
+            if self.controls_time != self.controls_marked:
+                self.controls_marked = self.controls_time
+                self.viewer.mark_input(self.controls_time)
+
         if self.allow_keyboard:
 
             keys_pressed = pygame.key.get_pressed()
@@ -1095,6 +3674,9 @@ class InputManager:
                 control_key = self.keyboard_assign[control]
                 controls_pressed[control] = keys_pressed[control_key]
 
+            if any(controls_pressed.values()):
+                self.viewer.mark_input()
+
             keyboard_translate = self.keyboard_dpdt * dt
             keyboard_zoom = 1.0 + self.keyboard_dsdt * dt
 
@@ -1131,7 +3713,7 @@ class InputManager:
 
 
 
-def handle_content(reload=True, invert=False):
+def handle_content(reload=True):
 
     entry_exists = archive_man.entry_exists()
     draw_images = image_viewer.get_draw_images()
@@ -1148,96 +3730,129 @@ def handle_content(reload=True, invert=False):
     image_viewer.set_draw_images(entry_exists)
 
     if entry_exists and reload:
-        image_viewer.loading_screen(invert=invert)
 
-        low_res, high_res = archive_man.get_opened_images()
+        page_key = archive_man.get_opened_key()
+        image_paths = archive_man.get_opened_images()
+
         dpi_ratio = archive_man.get_dpi_ratio()
+        image_viewer.load_images(page_cache.load_async(page_key, image_paths), dpi_ratio)
 
-        image_viewer.set_images(low_res, high_res, dpi_ratio)
+        page_cache.prefetch(archive_man.get_neighbour_pages())
 
         left_info, right_info = archive_man.get_opened_page()
         image_viewer.display_info((left_info, right_info), 5000)
 
 
-image_viewer = ImageViewer()
-archive_man = ArchiveManager()
-input_man = InputManager(image_viewer)
+def handle_new_entries(notify=True):
+
+    new_entries = archive_man.pop_new_entries()
+
+    for new_entry in new_entries:
+        page_cache.fill_raw(archive_man.get_entry_pages(new_entry))
+
+    new_sources = [archive_man.parse_name(new_entry)[0] for new_entry in new_entries]
+    if not notify or not archive_man.current_source in new_sources:
+        return
+
+    if archive_man.current_entry() in new_entries:
+        handle_content()
+
+    image_viewer.display_insert(ImageViewer.NEWENTRY, 3000)
+
+
+if __name__ == '__main__':
+
+    PerformanceMetrics.start()
+
+    image_viewer = ImageViewer()
+    archive_man = ArchiveManager()
+    input_man = InputManager(image_viewer)
+    page_cache = PageCache()
+
+    archive_man.update_available()
+    progress_gen = archive_man.download_recent()
+
+    for progress_perc in progress_gen:
+        image_viewer.download_screen(progress_perc)
+
+    handle_new_entries(notify=False)
+
+    archive_man.start_retention()
+    archive_man.start_sync()
 
-archive_man.update_available()
-progress_gen = archive_man.download_recent()
+    current_source = input_man.get_source()
+    archive_man.set_source(current_source)
 
-for progress_perc in progress_gen:
-    image_viewer.download_screen(progress_perc)
+    handle_content()
 
-current_source = input_man.get_source()
-archive_man.set_source(current_source)
 
-handle_content(invert=True)
+    while True:
 
+        dt = image_viewer.draw()
 
-while True:
+        input_man.button_input(dt)
+        input_man.control_input(dt)
 
-    dt = image_viewer.draw()
+        handle_new_entries()
 
-    input_man.button_input(dt)
-    input_man.control_input(dt)
+        for event in input_man.get_events():
+            good = False
 
-    for event in input_man.get_events():
-        good = False
+            image_viewer.mark_input()
 
-        if event == InputManager.NEXTENTRY:
-            print('Event: Next entry')
+            if event == InputManager.NEXTENTRY:
+                print('Event: Next entry')
 
-            good = archive_man.next_entry()
-            if not good:
-                image_viewer.display_insert(ImageViewer.LASTDATE, 2000)
+                good = archive_man.next_entry()
+                if not good:
+                    image_viewer.display_insert(ImageViewer.LASTDATE, 2000)
 
-        if event == InputManager.PREVENTRY:
-            print('Event: Previous entry')
+            if event == InputManager.PREVENTRY:
+                print('Event: Previous entry')
 
-            archive_man.prev_entry()
-            good = True
+                archive_man.prev_entry()
+                good = True
 
-        if event == InputManager.NEXTENTRYLONG:
-            print('Event: Newest entry')
+            if event == InputManager.NEXTENTRYLONG:
+                print('Event: Newest entry')
 
-            archive_man.newest_entry()
-            archive_man.remove_bookmark()
-            good = True
+                archive_man.newest_entry()
+                archive_man.remove_bookmark()
+                good = True
 
-            if archive_man.bookmark_set():
-                image_viewer.display_insert(ImageViewer.UNBOOKMARK, 2000)
+                if archive_man.bookmark_set():
+                    image_viewer.display_insert(ImageViewer.UNBOOKMARK, 2000)
 
-        if event == InputManager.PREVENTRYLONG:
-            print('Event: Bookmark')
+            if event == InputManager.PREVENTRYLONG:
+                print('Event: Bookmark')
 
-            archive_man.create_bookmark()
-            image_viewer.display_insert(ImageViewer.BOOKMARK, 2000)
+                archive_man.create_bookmark()
+                image_viewer.display_insert(ImageViewer.BOOKMARK, 2000)
 
-        if event == InputManager.NEXTPAGE:
-            print('Event: Next page')
+            if event == InputManager.NEXTPAGE:
+                print('Event: Next page')
 
-            good = archive_man.next_page()
-            if not good:
-                image_viewer.display_insert(ImageViewer.LASTPAGE, 2000)
+                good = archive_man.next_page()
+                if not good:
+                    image_viewer.display_insert(ImageViewer.LASTPAGE, 2000)
 
-        if event == InputManager.PREVPAGE:
-            print('Event: Previous page')
+            if event == InputManager.PREVPAGE:
+                print('Event: Previous page')
 
-            good = archive_man.prev_page()
-            if not good:
-                image_viewer.display_insert(ImageViewer.FIRSTPAGE, 2000)
+                good = archive_man.prev_page()
+                if not good:
+                    image_viewer.display_insert(ImageViewer.FIRSTPAGE, 2000)
 
-        if event == InputManager.NEXTPAGELONG:
-            print('Event: Last page')
+            if event == InputManager.NEXTPAGELONG:
+                print('Event: Last page')
 
-            archive_man.last_page()
-            good = True
+                archive_man.last_page()
+                good = True
 
-        if event == InputManager.PREVPAGELONG:
-            print('Event: First page')
+            if event == InputManager.PREVPAGELONG:
+                print('Event: First page')
 
-            archive_man.first_page()
-            good = True
+                archive_man.first_page()
+                good = True
 
-        handle_content(reload=good)
+            handle_content(reload=good)